@@ -0,0 +1,354 @@
+#! /usr/bin/env python
+'''
+Performs the ABBA-BABA tests on a table of allele frequencies made by freq.py
+and estimates the standard errors with the block jackknife, like
+ABBA_BABA_SimonMartin.R.
+
+The frequency table is read in blocks of lines. For every test the sums of
+ABBA, BABA, ABBA - BABA and the denominators of f and fd are kept per jackknife block (blocks
+of 1 Mb of a chromosome by default), the sites are not kept in memory. The
+sums of all tests are calculated at once with matrix products over the
+populations, so many tests cost little more than one. The estimates without
+a block are calculated from the totals minus the sums of that block.
+
+#Example input (freq.py output):
+
+#CHROM,POS,groupA,groupB,groupC,groupD
+scaffold_1,5,0.833333333333,0.5,0.666666666667,0.0
+scaffold_1,14,0.666666666667,0.333333333333,0.0,0.0
+scaffold_1,17,NA,NA,NA,NA
+
+#Example tests file:
+
+non_recipient,recipient,donor
+groupA,groupB,groupC
+
+#Example output:
+
+non_recipient,recipient,donor,D,D_err,D_Z,D_p,f,f_err,fd,fd_err
+groupA,groupB,groupC,0.013853702154,0.0133995077769,1.03389634788,0.301184622544,0.0323461317131,0.0308460349387,0.0166073465349,0.0158576751518
+
+#command:
+
+$ python ABBA_BABA.py -i genotypeCallsFile.freq -t tests.csv -o genotypeCallsFile.ABBA_BABA.csv
+
+The output has the statistics of ABBA_BABA_SimonMartin.R: D, its standard
+error, Z-score and p-value, f (Green et al. 2010, the donor is taken twice)
+and its standard error, and fd (Martin et al. 2015, the population with the
+higher derived allele frequency of recipient and donor is taken as donor).
+Sites with NA are skipped for the terms that use them, and for fd if any
+of the three populations is NA. The empty blocks
+between the first position and the end of a chromosome are counted, like
+in the R script. -b sets the block size.
+
+freq.py can write to the standard output, then the frequencies are not
+written to a file:
+
+$ python freq.py -i calls.tab -o /dev/stdout -p "..." -a derived -O groupD | python ABBA_BABA.py -i - -t tests.csv -o out.csv
+
+With -w the sums of the terms are also calculated for windows of -w bp in the
+same pass and written to --window-output, one line per window and test. A
+site at position pos is in the window (k*w, (k+1)*w] with k = ceil(pos/w) - 1,
+the windows without sites are not written and POS is the middle of the
+window. Values that cannot be calculated (a sum of zero in the denominator)
+are NA, e.g. fd of a window where the frequency of non_recipient equals the
+higher frequency of recipient and donor at every site:
+
+CHROM	POS	non_recipient	recipient	donor	sites	ABBA	BABA	D	fd_num	fd_den	fd
+scaffold_1	500	groupA	groupB	groupC	12	0.5	0.25	0.333333333333	0.25	1.5	0.166666666667
+scaffold_1	1500	groupA	groupB	groupC	1	0.0740740740741	0.296296296296	-0.6	-0.222222222222	0.0	NA
+
+$ python ABBA_BABA.py -i genotypeCallsFile.freq -t tests.csv -o out.csv -w 1000 --window-output out.windows.tab
+
+The binary output of freq.py (--binary) is read by memory mapping, -i is then
+its directory:
+
+$ python freq.py -i calls.tab -o calls.freq -p "..." -a derived -O groupD --binary float32
+$ python ABBA_BABA.py -i calls.freq -t tests.csv -o out.csv
+
+#contact:
+
+Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
+
+'''
+
+############################# modules #############################
+
+import argparse
+import bgzf  # compressed input and output
+import calls  # my custom module
+import estimators  # block jackknife
+import freqarray  # binary frequency tables
+import genotypes  # block reader of tables
+import math
+import numpy as np
+import sys
+
+############################# options #############################
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    '-i', '--input', help='name of the frequency file (or binary directory) made by freq.py, - for the standard input',
+    type=str, required=True)
+parser.add_argument(
+    '-t', '--tests', help='csv file with the tests: non_recipient,recipient,donor',
+    type=str, required=True)
+parser.add_argument(
+    '-o', '--output', help='name of the output file', type=str, required=True)
+parser.add_argument(
+    '-b', '--block', help='size of the jackknife blocks (bp)',
+    type=int, required=False, default=1000000)
+parser.add_argument(
+    '-w', '--window', help='sliding window size (optional)',
+    type=int, required=False)
+parser.add_argument(
+    '--window-output', help='name of the output file of the windows',
+    type=str, required=False)
+args = parser.parse_args()
+
+############################# functions #############################
+
+# sums kept per test and block
+TERMS = ['ABBA', 'BABA', 'ABBA_BABA', 'f_den', 'fd_den']
+
+
+def readTests(fileName):
+    ''' reads the tests file, returns its header and the tests as lists
+    of non_recipient, recipient and donor names'''
+    with open(fileName) as testFile:
+        rows = [line.replace(',', ' ').split() for line in testFile]
+    rows = [row for row in rows if row]
+    return rows[0], rows[1:]
+
+
+def csvLines(datafile):
+    ''' lines of a csv file with whitespace between the fields'''
+    for line in datafile:
+        yield line.replace(',', '\t')
+
+
+def readFreqBlocks(datafile, nColumns):
+    ''' yields chromosomes, positions and frequencies (NaN for NA) of blocks
+    of lines of a frequency file'''
+    for tokens in genotypes.readTokenBlocks(csvLines(datafile), nColumns):
+        freqs = np.where(tokens[:, 2:] == 'NA', 'nan', tokens[:, 2:]).astype(np.float64)
+        yield tokens[:, 0], tokens[:, 1].astype(np.int64), freqs
+
+
+class TestTerms(object):
+    ''' calculates the sums of the ABBA-BABA terms of all tests for runs of
+    sites with matrix products shared between the tests. With p the
+    frequencies and q = 1 - p (both 0 for NA) the terms are sums over the
+    sites:
+    ABBA (1-p1)p2p3 = qp[p1, (p2, p3)]    BABA p1(1-p2)p3 = qp[p2, (p1, p3)]
+    so one product of q with the needed pairs of p serves all tests. The
+    numerator ABBA - BABA and the denominators of f and fd are summed from
+    their per-site forms, so they are exactly 0 where the frequencies are equal:
+    ABBA - BABA       p3(p2 - p1) = pd[p3, (p2, p1)]
+    maxABBA - maxBABA p3(p3 - p1) = pd[p3, (p3, p1)]
+    fd denominator    pD(pD - p1) with pD = max(p2, p3)
+    where pd is the product of p with the differences of the pairs of p at
+    sites with both frequencies. The fd terms are counted at sites with all
+    three frequencies'''
+
+    def __init__(self, tests):
+        self.tests = tests
+        p1, p2, p3 = tests.T
+        pairs = sorted(set(zip(p2, p3) + zip(p1, p3)))
+        pairIndex = dict((pair, i) for i, pair in enumerate(pairs))
+        self.pairs = np.array(pairs).reshape(len(pairs), 2)
+        differences = sorted(set(zip(p2, p1) + zip(p3, p1)))
+        differenceIndex = dict((pair, i) for i, pair in enumerate(differences))
+        self.differences = np.array(differences).reshape(len(differences), 2)
+        self.terms = [
+            (p1, [pairIndex[pair] for pair in zip(p2, p3)]),
+            (p2, [pairIndex[pair] for pair in zip(p1, p3)])]
+        self.differenceTerms = [
+            (p3, [differenceIndex[pair] for pair in zip(p2, p1)]),
+            (p3, [differenceIndex[pair] for pair in zip(p3, p1)])]
+
+    def setSites(self, freqs):
+        ''' sets the frequency matrix (sites x populations) with NaN for NA'''
+        valid = ~np.isnan(freqs)
+        self.p = np.where(valid, freqs, 0)
+        self.q = valid - self.p
+        self.valid = valid
+
+    def sums(self, start, end):
+        ''' returns the sums of the terms of sites start:end (tests x terms
+        as one vector)'''
+        p = self.p[start:end]
+        q = self.q[start:end]
+        valid = self.valid[start:end]
+        qp = np.dot(q.T, p[:, self.pairs[:, 0]] * p[:, self.pairs[:, 1]])
+        a, b = self.differences.T
+        pd = np.dot(p.T, (p[:, a] - p[:, b]) * (valid[:, a] & valid[:, b]))
+        p1, p2, p3 = self.tests.T
+        pD = np.maximum(p[:, p2], p[:, p3])
+        fdSites = valid[:, p1] & valid[:, p2] & valid[:, p3]
+        terms = np.empty((len(self.tests), len(TERMS)))
+        for i, (c, pairs) in enumerate(self.terms):
+            terms[:, i] = qp[c, pairs]
+        for i, (c, pairs) in enumerate(self.differenceTerms):
+            terms[:, 2 + i] = pd[c, pairs]
+        terms[:, 4] = np.einsum('ij,ij->j', pD, (pD - p[:, p1]) * fdSites)
+        return terms.ravel()
+
+
+class WindowSums(estimators.BlockSums):
+    ''' sums of the terms of all tests and numbers of sites of windows
+    (k*windSize, (k+1)*windSize] of a chromosome, a window is passed to
+    write(Chr, number, sums) when it is finished instead of being kept'''
+
+    def __init__(self, windSize, nColumns, write):
+        estimators.BlockSums.__init__(self, windSize, nColumns)
+        self.write = write
+
+    def _addSum(self, key, blockSum):
+        if key != self.key:
+            self.finish()
+            self.key = key
+            self.open = np.zeros(self.nColumns)
+        self.open = self.open + blockSum
+
+    def finish(self):
+        if self.key is not None:
+            Chr, number = self.key
+            self.write(Chr, number, self.open)
+            self.key = None
+
+
+def windowRows(sums, tests):
+    ''' formats the tests of a window from its sums (terms of all tests and
+    the number of sites): test, number of sites, ABBA, BABA, D, and the
+    numerator, the denominator and the value of fd'''
+    nSites = int(sums[-1])
+    sums = sums[:-1].reshape(len(tests), len(TERMS))
+    D, f, fd = statistics(sums)
+    rows = []
+    for i, test in enumerate(tests):
+        ABBA, BABA, numerator, fDenominator, fdDenominator = sums[i].tolist()
+        values = [ABBA, BABA, float(D[i]), numerator, fdDenominator, float(fd[i])]
+        rows.append('\t'.join(test + [str(nSites)] +
+                               [formatValue(v) for v in values]))
+    return rows
+
+
+def statistics(sums):
+    ''' calculates D, f and fd from the sums of the terms (... x terms)'''
+    ABBA, BABA, numerator, fDenominator, fdDenominator = np.rollaxis(sums, -1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        D = numerator / (ABBA + BABA)
+        f = numerator / fDenominator
+        fd = numerator / fdDenominator
+    return D, f, fd
+
+
+def formatValue(value):
+    ''' NA for NaN and infinite values, -0.0 is written as 0.0'''
+    if math.isnan(value) or math.isinf(value):
+        return 'NA'
+    return str(value + 0.0)
+
+############################# program #############################
+
+testHeader, tests = readTests(args.tests)
+
+if freqarray.isBinary(args.input):
+    # binary table of freq.py --binary
+    datafile = None
+    table = freqarray.FreqArray(args.input)
+    popNames = table.populations
+    freqBlocks = table.blocks()
+else:
+    if args.input == '-':
+        datafile = sys.stdin
+    else:
+        datafile = bgzf.openFile(args.input)
+    names = datafile.readline().replace(',', ' ').split()
+    popNames = names[2:]
+    freqBlocks = readFreqBlocks(datafile, len(names))
+
+for test in tests:
+    for pop in test:
+        if pop not in popNames:
+            raise IOError('Population "%s" is not found in the header of %s'
+                          % (pop, args.input))
+testColumns = np.array([[popNames.index(pop) for pop in test]
+                        for test in tests]).reshape(len(tests), 3)
+
+testTerms = TestTerms(testColumns)
+blockSums = estimators.BlockSums(args.block, len(tests) * len(TERMS))
+chromEnds = {}  # last position of every chromosome
+
+if args.window:
+    if not args.window_output:
+        raise IOError('The output file of the windows (--window-output) is required with -w')
+    windowFile = bgzf.openFile(args.window_output, 'w')
+    windowFile.write('\t'.join(['CHROM', 'POS'] + testHeader +
+                               ['sites', 'ABBA', 'BABA', 'D', 'fd_num', 'fd_den', 'fd']) + '\n')
+
+
+def writeWindow(Chr, number, sums):
+    ''' writes the tests of the window number (0-based) of a chromosome, POS
+    is the middle of the window'''
+    for row in windowRows(sums, tests):
+        calls.processWindow(Chr, number * args.window, (number + 1) * args.window,
+                            row, windowFile)
+
+
+def windowSites(start, end):
+    ''' sums of the terms and the number of the sites start:end'''
+    return np.r_[testTerms.sums(start, end), end - start]
+
+
+if args.window:
+    windowSums = WindowSums(args.window, len(tests) * len(TERMS) + 1, writeWindow)
+
+linesDone = 0
+for chroms, positions, freqs in freqBlocks:
+    testTerms.setSites(freqs)
+    blockSums.addSums(chroms, positions, testTerms.sums)
+    if args.window:
+        windowSums.addSums(chroms, positions, windowSites)
+
+    # last positions of the chromosomes of the block
+    ends = np.r_[np.flatnonzero(chroms[1:] != chroms[:-1]), len(chroms) - 1]
+    for Chr, pos in zip(chroms[ends].tolist(), positions[ends].tolist()):
+        chromEnds[Chr] = max(pos, chromEnds.get(Chr, 0))
+
+    linesDone += len(positions)
+    if linesDone // 1000000 != (linesDone - len(positions)) // 1000000:
+        sys.stderr.write('%s lines done...\n' % linesDone)
+
+if args.window:
+    windowSums.finish()
+    windowFile.close()
+
+if datafile is not None and datafile is not sys.stdin:
+    datafile.close()
+
+# blocks without sites count as blocks of zero sums
+sums = blockSums.sums()
+nBlocks = sum((end - 1) // args.block + 1 for end in chromEnds.values())
+sums = np.vstack([sums, np.zeros((max(nBlocks - len(sums), 0), sums.shape[1]))])
+sums = sums.reshape(len(sums), len(tests), len(TERMS))
+
+totals = sums.sum(axis=0)
+D, f, fd = statistics(totals)
+DPartial, fPartial, fdPartial = statistics(totals - sums)
+DErr = estimators.blockJackknife(D, DPartial)
+fErr = estimators.blockJackknife(f, fPartial)
+fdErr = estimators.blockJackknife(fd, fdPartial)
+with np.errstate(invalid='ignore', divide='ignore'):
+    DZ = D / DErr
+DP = [math.erfc(abs(z) / math.sqrt(2)) if z == z else np.nan
+      for z in DZ.tolist()]
+
+output = bgzf.openFile(args.output, 'w')
+output.write(','.join(testHeader + ['D', 'D_err', 'D_Z', 'D_p', 'f', 'f_err',
+                                    'fd', 'fd_err']) + '\n')
+for i, test in enumerate(tests):
+    values = [D[i], DErr[i], DZ[i], DP[i], f[i], fErr[i], fd[i], fdErr[i]]
+    output.write(','.join(test + [formatValue(float(v)) for v in values]) + '\n')
+output.close()
@@ -0,0 +1 @@
+../bgzf.py
\ No newline at end of file
@@ -0,0 +1 @@
+../calls.py
\ No newline at end of file
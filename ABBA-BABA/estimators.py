@@ -0,0 +1 @@
+../estimators.py
\ No newline at end of file
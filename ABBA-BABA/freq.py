@@ -28,17 +28,56 @@ the populations are specified in a single string as follows:
 
 the pout-group must match one of the population names. e.g. -O pop2Name
 
+The calls are read in blocks of sites, decoded with lookup tables and the alleles of all populations are counted
+for a whole block at once. Two-character calls (A/T, ./.) are converted to the one-letter codes.
+The biallelic sites, their polarization and the frequencies are also found with array operations
+and every block is written at once.
+
+With --binary float32 (or float16) the frequencies are written as a binary table to the directory given by -o:
+a JSON header with the populations and chromosomes, and raw arrays of the positions and of the frequencies
+(NaN for NA) that can be memory mapped and sliced by region without parsing (see freqarray.py).
+
+python freq.py -i <input file> -o <output directory> -p <population_string> -a derived -O <out-group population name> --binary float32
+
+A region can be processed with -r chr:start-end. The input file is indexed on the first use of -r (see tabindex.py).
+
+With -T the input is processed by several processes: it is split at chromosome boundaries and chromosomes larger
+than --shard-size bytes (100 Mb by default) are split at line starts. The pieces are merged in the input order,
+so the output is the same as with one process. The lines of every chromosome must be contiguous in the input file.
+
 ***********************************************************************************************
 
 Modified to use single nucleotide gaps "-" by Dmytro Kryvokhyzha (dmytro.kryvokhyzha@evobio.eu)
 """
 
+import argparse
 import sys
+import StringIO
+import bgzf # compressed input and output
+import freqarray # binary output
+import genotypes # block reader of calls tables
+import numpy as np
+import tabindex # index of tables, region queries and parallel processing
+
+### Options
+parser = argparse.ArgumentParser()
+parser.add_argument("-i", "--input", help = "name of the input file", type=str, required=True)
+parser.add_argument("-o", "--output", help = "name of the output file (directory with --binary)", type=str, required=True)
+parser.add_argument("-p", "--populations", help = "populations: \"pop1Name[ind1,ind2];pop2Name[ind3,ind4]\"", type=str, required=True)
+parser.add_argument("-a", "--allele", help = "allele to calculate the frequency of", choices=["minor", "derived"], required=True)
+parser.add_argument("-O", "--outgroup", help = "out-group population, required with -a derived", type=str, required=False)
+parser.add_argument("-M", "--min-calls", help = "minimum number of called individuals per population", type=int, required=False, default=1)
+parser.add_argument("--consensus", help = "take the consensus of an out-group with two alleles", action="store_true")
+parser.add_argument("--binary", help = "write a binary table of this float type", choices=freqarray.DTYPES, required=False)
+parser.add_argument("-r", "--region", help = "region to process, chr:start-end (optional)", type=str, required=False)
+parser.add_argument("-T", "--threads", help = "number of processes to process the input in parallel", type=int, required=False, default=1)
+parser.add_argument("--shard-size", help = "size (bytes) of the pieces of the chromosomes processed in parallel", type=int, required=False, default=100000000)
+args = parser.parse_args()
 
 ### Functions
 def get_intv(string,borders = "()",inc = False):
   if len(borders) != 2:
-    print "WARNING: borders must contain two characters"
+    sys.stderr.write("WARNING: borders must contain two characters\n")
   starts = []
   ends = []
   output = []
@@ -61,207 +100,169 @@ def get_intv(string,borders = "()",inc = False):
         output.append(string[starts[n]+1:ends[n]-1])
   return output
 
-def haplo(calls):
-  output = []
-  for call in calls:
-    if call in "ACGTN-":
-      output.append(call)
-      output.append(call)
-    elif call == "K":
-      output.append("G")
-      output.append("T")
-    elif call == "M":
-      output.append("A")
-      output.append("C")
-    elif call == "R":
-      output.append("A")
-      output.append("G")
-    elif call == "S":
-      output.append("C")
-      output.append("G")
-    elif call == "W":
-      output.append("A")
-      output.append("T")
-    elif call == "Y":
-      output.append("C")
-      output.append("T")
-    else:
-      print "WARNING", call, "is not recognised as a valid base or ambiguous base"
-      output.append("N")
-      output.append("N")
-  return output
-
-def getOptionValue(option):
-  optionPos = [i for i,j in enumerate(sys.argv) if j == option][0]
-  optionValue = sys.argv[optionPos + 1]
-  return optionValue
-  
-def unique(things):
-  output = []
-  for x in things:
-    if x not in output:
-      output.append(x)
-  output.sort()
-  return output
-
-
-def exclude(things, x):
-  output = [i for i in things if i != x]
-  return(output)
+# alleles in the sorting order of the original unique(), a tie of the
+# most common alleles is resolved to the first one in this order
+ALLELES = "-ACGT"
+
+# valid calls and their alleles, heterozygous IUPAC codes have one of each allele
+CALLS = [("N", ""), ("A", "AA"), ("C", "CC"), ("G", "GG"), ("T", "TT"), ("-", "--"),
+         ("K", "GT"), ("M", "AC"), ("R", "AG"), ("S", "CG"), ("W", "AT"), ("Y", "CT")]
+
+def callTables():
+  """ creates a lookup table of the index of every one-letter call in CALLS (unknown
+  calls get the last index) and a table of the allele counts of every index"""
+  index = np.empty(256, dtype=np.intp)
+  index.fill(len(CALLS))
+  haplo = np.zeros((len(CALLS) + 1, len(ALLELES)), dtype=np.int64)
+  for i, (call, pair) in enumerate(CALLS):
+    index[ord(call)] = i
+    haplo[i] = [pair.count(a) for a in ALLELES]
+  return index, haplo
+
+CALL_INDEX, HAPLO = callTables()
+
+def callCounts(codes):
+  """ counts the calls (in CALLS order, unknown calls last) of every site
+  of a block of calls (sites x samples)"""
+  nCalls = len(CALLS) + 1
+  bins = CALL_INDEX[codes] + (np.arange(len(codes)) * nCalls)[:, None]
+  return np.bincount(bins.ravel(), minlength=len(codes)*nCalls).reshape(len(codes), nCalls)
+
+def alleleCounts(calls):
+  """ returns the allele counts (in ALLELES order) of every site (sites x alleles)"""
+  return np.dot(calls, HAPLO)
+
+def countAlleles(counts):
+  """ returns the number of different alleles of every site"""
+  return (counts > 0).sum(axis=1)
+
+def formatFreqs(freqs):
+  """ converts a matrix of frequencies to strings like str() does, NaN to NA,
+  every distinct frequency is formatted once"""
+  freqs = np.where(np.isnan(freqs), -1, freqs)
+  values, inverse = np.unique(freqs, return_inverse=True)
+  strings = np.array(["NA" if v == -1 else str(v) for v in values.tolist()], dtype=object)
+  return strings[inverse].reshape(freqs.shape)
+
+def blockFreqs(codes):
+  """ returns the frequencies (sites x populations, NaN for NA) of a block of calls (sites x samples)"""
+  # count the alleles of all populations at once
+  calls = callCounts(codes)
+  if calls[:, -1].any():
+    for code in np.unique(codes[CALL_INDEX[codes] == len(CALLS)]).tolist():
+      sys.stderr.write("WARNING %s is not recognised as a valid base or ambiguous base\n" % chr(code))
+  siteCounts = alleleCounts(calls)
+  popCounts = []
+  popCalled = []
+  for pop in pops:
+    calls = callCounts(codes[:, popCols[pop]])
+    popCounts.append(alleleCounts(calls))
+    popCalled.append(len(popCols[pop]) - calls[:, 0]) # calls that are not N
 
-def uniqueAlleles(bases):
-  haploBases = haplo(bases)
-  output = unique([i for i in haploBases if i in "ACGT-"])
-  return output
-
-
-def baseFreq(bases,base):
-  haploBases = [i for i in haplo(bases) if i in "ACGT-"]
-  freq = (float(haploBases.count(base))) / len(haploBases)
-  return freq
-
-def mostCommon(things):
-  output = []
-  counts = []
-  uniqueThings = unique(things)
-  for thing in uniqueThings:
-    counts.append(things.count(thing))
-  maxCount = max(counts)
-  for n in range(len(counts)):
-    if counts[n] == maxCount:
-      output.append(uniqueThings[n])
-  return output
-
-def majorAllele(bases):
-  haploBases = [i for i in haplo(bases) if i in "ACGT-"]
-  major = mostCommon(haploBases)[0]
-  return major[0]
+  # check not triallelic
+  nAlleles = countAlleles(siteCounts)
+  # get major allele or ancestral state, a tie goes to the first allele in ALLELES order
+  if derived:
+    ogCounts = popCounts[pops.index(outGroup)]
+    ogAlleles = countAlleles(ogCounts)
+    refState = np.argmax(ogCounts, axis=1)
+    polarized = (ogAlleles == 1) | ((ogAlleles == 2) & outgroupConsensus)
+  else:
+    refState = np.argmax(siteCounts, axis=1)
+    polarized = np.ones(len(siteCounts), dtype=bool)
+
+  sites = np.arange(len(siteCounts))
+  freqs = np.empty((len(siteCounts), len(pops)))
+  with np.errstate(invalid='ignore', divide='ignore'):
+    for p in range(len(pops)):
+      freqs[:, p] = 1 - popCounts[p][sites, refState].astype(float) / popCounts[p].sum(axis=1)
+      freqs[popCalled[p] < popMin, p] = np.nan
+  freqs[nAlleles == 1] = 0.0
+  freqs[(nAlleles == 0) | (nAlleles > 2) | ((nAlleles == 2) & ~polarized)] = np.nan
+  return freqs
+
+def csvText(Chrs, positions, freqs):
+  """ formats a block of frequencies as lines of the csv output"""
+  columns = [Chrs.tolist(), map(str, positions.tolist())] + formatFreqs(freqs).T.tolist()
+  return "".join(",".join(row) + "\n" for row in zip(*columns))
+
+def processLines(lines, write, progress=False):
+  """ calculates the frequencies of the lines of the input file and calls write(Chrs, positions, freqs)
+  for every block"""
+  linesDone = 0
+  for Chrs, positions, codes in genotypes.readBlocks(lines, range(2, len(names)), len(names)):
+    write(Chrs, positions, blockFreqs(codes))
+    linesDone += len(positions)
+    if progress and linesDone // 1000000 != (linesDone - len(positions)) // 1000000:
+      sys.stderr.write("%s lines done...\n" % linesDone)
+
+def processShard(fileName, start, end, resumed):
+  """ calculates the frequencies of a piece of the input file in a worker process, returns the csv text
+  or the blocks of arrays with --binary"""
+  if args.binary:
+    blocks = []
+    processLines(tabindex.readRange(fileName, start, end), lambda *block: blocks.append(block))
+    return blocks
+  output = StringIO.StringIO()
+  processLines(tabindex.readRange(fileName, start, end), lambda *block: output.write(csvText(*block)))
+  return output.getvalue()
 
 ### get files
 
-if "-i" in sys.argv:
-  fileName = getOptionValue("-i")
-else:
-  print "\nplease specify input file name using -i <file_name> \n"
-  sys.exit()
-  
-file = open(fileName, "rU")
+file = tabindex.openTable(args.input, args.region)
 line = file.readline()
 names = line.split()
-line= file.readline()
 
+popString = args.populations
+derived = args.allele == "derived"
+outGroup = args.outgroup
+popMin = args.min_calls
+outgroupConsensus = args.consensus
 
-if "-o" in sys.argv:
-  outName = getOptionValue("-o")
-  out = open(outName, "w")
-else:
-  print "\nplease specify output file name using -o <file_name> \n"
-  sys.exit()
-
-if "-p" in sys.argv:
-  popString = getOptionValue("-p")
-else:
-  print "\nplease specify populations using -p\n"
+if derived and not outGroup:
+  sys.stderr.write("\nPlease specify outgroup population using -O\n\n")
   sys.exit()
 
-if "-a" in sys.argv:
-  if getOptionValue("-a") == "derived":
-    derived = True
-  elif getOptionValue("-a") == "minor":
-    derived = False
-  else:
-    print "\nAllele (-a) can only be 'minor' or 'derived'."
-    sys.exit()
-else:
-  print "\nPlease specify whether the derived or minor allele frequency must be calculated.\n"
-  sys.exit()
-
-if "-O" in sys.argv:
-  outGroup = getOptionValue("-O")
-else:
-  if derived:
-    print "\nPlease specify outgroup population using -O\n"
-    sys.exit()
-
-if "-M" in sys.argv:
-  popMin = int(getOptionValue("-M"))
-else:
-  popMin = 1
-
-
-if "--consensus" in sys.argv:
-  outgroupConsensus = True
-else:
-  outgroupConsensus = False
-
 pops = []
-#for each population, store the name and individual names
+popCols = {}
+#for each population, store the name and the columns of the individuals
 for popData in popString.strip("\"").split(";"):
   currentPop = popData.split("[")[0]
   pops.append(currentPop)
-  vars()[currentPop + "Inds"] = get_intv(popData,"[]")[0].split(",")
-  for ind in vars()[currentPop + "Inds"]:
+  popInds = get_intv(popData,"[]")[0].split(",")
+  for ind in popInds:
     if ind not in names:
-      print ind, "not found in header line."
+      sys.stderr.write("%s not found in header line.\n" % ind)
       sys.exit()
+  popCols[currentPop] = [names.index(ind) - 2 for ind in popInds] # columns of the calls
 
 if derived and outGroup not in pops:
-  print "\nThe specified outgroup, ", outGroup, ", was not a specified population."
+  sys.stderr.write("\nThe specified outgroup,  %s , was not a specified population.\n" % outGroup)
   sys.exit()
 
 # write output header
-out.write(names[0] + "," + names[1])
-for pop in pops:
-  out.write("," + pop)
-out.write("\n")
-
-linesDone = 0
-
-### for each line, check if its a biallelic SNP, if so, continue to other populations
-while len(line) > 1:
-  objects = line.split()
-  output = [objects[0],objects[1]]
-  # check not triallelic
-  alleles = uniqueAlleles(objects[2:])
-  if len(alleles) == 0 or len(alleles) > 2:
-    for pop in pops:
-      output.append("NA")
-  elif len(alleles) == 1:
-    for pop in pops:
-      output.append("0.0")
-  else:
-    # get major allele or ancestral state
-    if derived:
-      ogBases = []
-      for ind in vars()[outGroup + "Inds"]:
-        ogBases.append(objects[names.index(ind)])
-      ogAlleles = uniqueAlleles(ogBases)
-      if len(ogAlleles) == 1:
-        refState = ogAlleles[0]
-      elif len(ogAlleles) == 2 and outgroupConsensus:
-        refState = majorAllele(ogBases)
-      else:
-        refState = None
-    else:
-      refState = majorAllele(objects[2:])
-    if refState:
-      for pop in pops:
-        popCalls = []
-        for ind in vars()[pop + "Inds"]:
-          popCalls.append(objects[names.index(ind)])
-        if len(exclude(popCalls,"N")) >= popMin:
-          freq = 1 - baseFreq(popCalls,refState)
-        else: freq = "NA"
-        output.append(str(freq))
+if args.binary:
+  out = freqarray.FreqWriter(args.output, pops, args.binary)
+  writeBlock = out.write
+else:
+  out = bgzf.openFile(args.output, "w")
+  out.write(names[0] + "," + names[1])
+  for pop in pops:
+    out.write("," + pop)
+  out.write("\n")
+  writeBlock = lambda *block: out.write(csvText(*block))
+
+### for each block of lines, find the biallelic SNPs and calculate the frequencies of all populations
+if args.threads > 1 and not args.region:
+  # the populations and columns are inherited by the worker processes, the shards are merged in the input order
+  for result in tabindex.runSharded(args.input, processShard, args.threads, args.shard_size):
+    if args.binary:
+      for block in result:
+        out.write(*block)
     else:
-      for pop in pops:
-        output.append("NA")
-  out.write(",".join(output))
-  out.write("\n")    
-  line = file.readline()
-  linesDone += 1
-  if linesDone % 1000000 == 0:
-    print linesDone, "lines done..."
-
-out.close
-file.close
+      out.write(result)
+else:
+  processLines(file, writeBlock, progress=True)
+
+out.close()
+file.close()
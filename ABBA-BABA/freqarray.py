@@ -0,0 +1,152 @@
+#! /usr/bin/env python
+'''
+Binary tables of allele frequencies (freq.py --binary) that are read by
+memory mapping, without parsing.
+
+A table is a directory with a small JSON header and raw arrays:
+
+header.json      populations, dtype, number of sites, chromosome runs
+positions.bin    positions of the sites (int64)
+freqs.bin        frequencies (sites x populations, float32 or float16),
+                 NaN for NA
+
+The sites are stored in the input order. The header keeps every run of sites
+of the same chromosome as [chromosome, first site, last site + 1], so a region
+is found with a binary search of the positions of its runs.
+
+#Example:
+
+import freqarray
+
+table = freqarray.FreqArray('genotypeCallsFile.freq')
+positions, freqs = table.region('scaffold_1', 1, 1000000)
+groupB = freqs[:, table.populations.index('groupB')]
+
+#contact:
+
+Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
+
+'''
+
+############################# modules #############################
+
+import json
+import numpy as np
+import os
+
+############################# functions #############################
+
+HEADER = 'header.json'
+POSITIONS = 'positions.bin'
+FREQS = 'freqs.bin'
+DTYPES = ['float32', 'float16']
+
+
+class FreqWriter(object):
+    ''' writes blocks of sites to a binary table in the directory path'''
+
+    def __init__(self, path, populations, dtype='float32'):
+        if dtype not in DTYPES:
+            raise IOError('Binary frequencies can only be %s, not %s'
+                          % (' or '.join(DTYPES), dtype))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.populations = list(populations)
+        self.dtype = dtype
+        self.nSites = 0
+        self.chromosomes = [] # runs of [chromosome, first site, last site + 1]
+        self.positionFile = open(os.path.join(path, POSITIONS), 'wb')
+        self.freqFile = open(os.path.join(path, FREQS), 'wb')
+
+    def write(self, chroms, positions, freqs):
+        ''' appends sites with frequencies as a matrix (sites x populations)'''
+        if len(positions) == 0:
+            return
+        chroms = np.asarray(chroms)
+        starts = np.r_[0, np.flatnonzero(chroms[1:] != chroms[:-1]) + 1]
+        ends = np.r_[starts[1:], len(chroms)]
+        for Chr, start, end in zip(chroms[starts].tolist(), starts.tolist(), ends.tolist()):
+            if self.chromosomes and self.chromosomes[-1][0] == Chr and \
+                    self.chromosomes[-1][2] == self.nSites + start:
+                self.chromosomes[-1][2] = self.nSites + end
+            else:
+                self.chromosomes.append([Chr, self.nSites + start, self.nSites + end])
+        self.positionFile.write(np.asarray(positions, dtype='<i8').tostring())
+        self.freqFile.write(np.asarray(freqs).astype('<' + np.dtype(self.dtype).str[1:]).tostring())
+        self.nSites += len(positions)
+
+    def close(self):
+        ''' closes the arrays and writes the header'''
+        self.positionFile.close()
+        self.freqFile.close()
+        header = {'populations': self.populations,
+                  'dtype': self.dtype,
+                  'sites': self.nSites,
+                  'chromosomes': self.chromosomes}
+        with open(os.path.join(self.path, HEADER), 'w') as headerFile:
+            json.dump(header, headerFile, indent=1)
+            headerFile.write('\n')
+
+
+def isBinary(path):
+    ''' True if path is a binary table'''
+    return os.path.isfile(os.path.join(path, HEADER))
+
+
+class FreqArray(object):
+    ''' memory mapped binary table: populations, chromosomes (runs of
+    [chromosome, first site, last site + 1]), positions and freqs'''
+
+    def __init__(self, path):
+        with open(os.path.join(path, HEADER)) as headerFile:
+            header = json.load(headerFile)
+        self.populations = [str(pop) for pop in header['populations']]
+        self.chromosomes = [[str(Chr), start, end] for Chr, start, end in header['chromosomes']]
+        nSites = header['sites']
+        self.positions = self._map(os.path.join(path, POSITIONS), '<i8', (nSites,))
+        self.freqs = self._map(os.path.join(path, FREQS),
+                               '<' + np.dtype(str(header['dtype'])).str[1:],
+                               (nSites, len(self.populations)))
+
+    @staticmethod
+    def _map(fileName, dtype, shape):
+        if shape[0] == 0:
+            # an empty file cannot be mapped
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(fileName, dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def region(self, Chr, start=None, end=None):
+        ''' returns the positions and the frequencies of the sites of Chr
+        with start <= position <= end (the whole chromosome by default)'''
+        selected = []
+        for name, first, last in self.chromosomes:
+            if name != Chr:
+                continue
+            positions = self.positions[first:last]
+            if start is not None:
+                first += int(np.searchsorted(positions, start, 'left'))
+            if end is not None:
+                last = first + int(np.searchsorted(self.positions[first:last], end, 'right'))
+            selected.append((first, last))
+        if not selected:
+            return self.positions[:0], self.freqs[:0]
+        if len(selected) == 1:
+            first, last = selected[0]
+            return self.positions[first:last], self.freqs[first:last]
+        return (np.concatenate([self.positions[s:e] for s, e in selected]),
+                np.concatenate([self.freqs[s:e] for s, e in selected]))
+
+    def blocks(self, blockSize=100000):
+        ''' yields chromosomes, positions and frequencies (float64) of blocks
+        of sites in the stored order'''
+        for name, first, last in self.chromosomes:
+            for start in range(first, last, blockSize):
+                end = min(start + blockSize, last)
+                chroms = np.empty(end - start, dtype=object)
+                chroms[:] = name
+                yield (chroms, np.asarray(self.positions[start:end]),
+                       np.asarray(self.freqs[start:end], dtype=np.float64))
@@ -0,0 +1 @@
+../genotypes.py
\ No newline at end of file
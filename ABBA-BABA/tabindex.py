@@ -0,0 +1 @@
+../tabindex.py
\ No newline at end of file
@@ -27,9 +27,13 @@ contact Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
 
 ############################# modules #############################
 
+import bgzf  # compressed input and output
 import calls  # my custom module
+import genotypes # block reader of calls tables
+import numpy as np
 import re # to split input
 from collections import Counter # for counting
+import tabindex  # index of tables and region queries
 ############################# options #############################
 
 parser = calls.CommandLineParser()
@@ -49,11 +53,14 @@ parser.add_argument(
         -s "pop1[sample1,...];pop2[sample4,...]"',
     type=str,
     required=True)
+parser.add_argument(
+    '-r', '--region', help='region to process, chr:start-end (optional)',
+    type=str, required=False)
 args = parser.parse_args()
 
 ############################# program #############################
 
-with open(args.input) as datafile:
+with tabindex.openTable(args.input, args.region) as datafile:
     # process header
     header = datafile.readline()
     while header.startswith("##"):
@@ -81,7 +88,7 @@ with open(args.input) as datafile:
         popSamples[pName] = Psamples
     
     # create the output file
-    output = open(args.output, 'w')
+    output = bgzf.openFile(args.output, 'w')
     print('Creating the output file...')
     selPopP = str(selPop)+"Freq"
     pNameP = str(pName)+"Freq"
@@ -93,37 +100,50 @@ with open(args.input) as datafile:
     for pop in popSamples:
         popCol[pop] = calls.indexSamples(popSamples[pop], header_words)
 
-    for line in datafile:
-        words = line.split()
-        chr = words[0]
-        pos = int(words[1])
-        anc = words[2]
-        der = words[3]
-
+    for tokens in genotypes.readTokenBlocks(datafile, len(header_words)):
         # calculate frequencies of derived allele
         popFreq = {}
         for pop in popCol:
-            gt = calls.selectSamples(popCol[pop], words)
-            gtSplit = []
-            for g in gt:
-                gtSplit.append(g.split("|"))
-            gtSplitF = calls.flattenList(gtSplit)
-            if len(set(gtSplitF)) <= 2:
-                gtCount = Counter(gtSplitF)
-                popFreq[pop] = float(gtCount['1'])/float(len(gtSplitF))
+            gt = np.ascontiguousarray(tokens[:, popCol[pop]])
+            if gt.dtype.itemsize == 3:
+                # phased diploid calls "0|1"
+                raw = gt.view(np.uint8).reshape(gt.shape + (3,))
+                haplotypes = raw[:, :, [0, 2]].reshape(len(gt), -1)
+                phased = (raw[:, :, 1] == ord("|")).all(axis=1)
             else:
-                popFreq[pop] = "NA"
-        
+                haplotypes = np.zeros((len(gt), 0), dtype=np.uint8)
+                phased = np.zeros(len(gt), dtype=bool)
+            sortedHap = np.sort(haplotypes, axis=1)
+            nAlleles = 1 + (np.diff(sortedHap, axis=1) != 0).sum(axis=1)
+            freq = ((haplotypes == ord("1")).sum(axis=1) /
+                    float(haplotypes.shape[1] or 1))
+            freq = freq.tolist()
+            # sites with other genotype formats are processed one by one
+            for i in np.flatnonzero(~phased):
+                gtSplit = []
+                for g in gt[i]:
+                    gtSplit.append(g.split("|"))
+                gtSplitF = calls.flattenList(gtSplit)
+                nAlleles[i] = len(set(gtSplitF))
+                freq[i] = float(Counter(gtSplitF)['1'])/float(len(gtSplitF))
+            popFreq[pop] = [f if n <= 2 else "NA"
+                            for f, n in zip(freq, nAlleles.tolist())]
+
         # calculate delta DAF
-        if (popFreq[selPop] != 'NA' and popFreq[pName] != 'NA') and \
-           (popFreq[selPop] != 0.0 or popFreq[pName] != 0.0):
-            deltaDAF = popFreq[selPop] - popFreq[pName]
-            deltaDAFP= round(deltaDAF, 5)
-            Pop1FreqP= round(popFreq[selPop], 5)
-            Pop2FreqP= round(popFreq[pName], 5)
-
-            output.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (chr, pos, anc, der, 
-                         Pop1FreqP, Pop2FreqP, deltaDAFP))       
+        outLines = []
+        for i, (chr, pos, anc, der) in enumerate(tokens[:, :4].tolist()):
+            selFreq = popFreq[selPop][i]
+            othFreq = popFreq[pName][i]
+            if (selFreq != 'NA' and othFreq != 'NA') and \
+               (selFreq != 0.0 or othFreq != 0.0):
+                deltaDAF = selFreq - othFreq
+                deltaDAFP= round(deltaDAF, 5)
+                Pop1FreqP= round(selFreq, 5)
+                Pop2FreqP= round(othFreq, 5)
+
+                outLines.append("%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (chr, int(pos),
+                                anc, der, Pop1FreqP, Pop2FreqP, deltaDAFP))
+        output.write("".join(outLines))
 
 datafile.close()
 output.close()
@@ -41,6 +41,8 @@ Derived-allele-freq Number-of-sites
 
 The histograms of SFS is also produced.
 
+The ancestor file is indexed on the first run (ancestor.file.anc/), later runs with the same ancestor file load the index without parsing the file. Sites absent from the ancestor file are skipped.
+
 
 # command
 
@@ -50,17 +52,41 @@ Optionally samples can be specified with -s "sample1,sample2...sampleN"
 
 To use sites with missing data, specify number of allowed Ns. This will produced reduced SFS by using subsampling from hypergeometric distribution. (Hernandez, Ryan D., et al. "Context-dependent mutation rates may cause spurious signatures of a fixation bias favoring higher GC-content in humans." Molecular biology and evolution 24.10 (2007): 2196-2202.)
 
+The subsampling is random, so the SFS differs slightly between runs. Use --seed to make it reproducible, or -e to add the expected hypergeometric probabilities of every site to the SFS instead of a single random draw. The -e option gives an exact SFS with fractional numbers of sites in one run.
+
+$ python SFS.py -i input.file -o output.file -a ancestor.file -m 2 -e
+
+Several groups of samples are processed in one pass over the input file if -s is given several times or the groups are listed in a file with -p:
+
+pop1    sample1,sample2,sample3,sample4
+pop2    sample5,sample6,sample7,sample8
+
+$ python SFS.py -i input.file -o output.file -a ancestor.file -p populations.file -j "pop1,pop2"
+
+This produces one table and one histogram per group (output.file.pop1, output.file.pop2) and the joint SFS of pop1 and pop2. The joint SFS can be calculated for two or more groups (-j "pop1,pop2,pop3"). It is written as a table of the non-zero classes (output.file.pop1-pop2):
+
+pop1    pop2    Number-of-sites
+0       0       4
+0       1       2
+2       1       1
+
+and as a NumPy array of shape (n1+1, n2+1[, n3+1]) that can be loaded with numpy.load() (output.file.pop1-pop2.npy). Only sites that are biallelic over all groups of a joint SFS are used in it.
+
 contact Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
 '''
 
 ############################# modules #############################
 
+import ancestor # indexed ancestral states
+import bgzf # compressed input and output
 import calls # my custom module
 import collections
+import genotypes # block reader of calls tables
 import matplotlib
 matplotlib.use('Agg') # to avoid RuntimeError('Invalid DISPLAY variable'). Must be before importing matplotlib.pyplot!
 import matplotlib.pyplot as plt
 import numpy as np
+import tabindex # index of tables and region queries
 
 ############################# options #############################
 
@@ -69,11 +95,43 @@ parser.add_argument('-i', '--input', help = 'name of the input file', type=str,
 parser.add_argument('-o', '--output', help = 'name of the output file', type=str, required=True)
 parser.add_argument('-a', '--ancestor', help = 'name of the file with ancestral sequence to polarize alleles', type=str, required=True)
 parser.add_argument('-m', '--missing', help = 'allowed number of missing data', type=int, required=False)
-parser.add_argument('-s', '--samples', help = 'column names of the samples to process (optional)', type=str, required=False)
+parser.add_argument('-s', '--samples', help = 'column names of the samples to process (optional), can be given several times to process several groups of samples', type=str, action='append', required=False)
+parser.add_argument('-p', '--populations', help = 'name of the file with groups of samples to process (optional), one group per line: "name sample1,sample2,..."', type=str, required=False)
+parser.add_argument('-j', '--joint', help = 'names of two or more groups to calculate the joint SFS for (optional), e.g. -j "pop1,pop2", can be given several times', type=str, action='append', required=False)
+parser.add_argument('-e', '--expected', help = 'project sites with missing data using expected hypergeometric probabilities instead of random subsampling', action='store_true')
+parser.add_argument('--seed', help = 'seed of the random subsampling (optional)', type=int, required=False)
+parser.add_argument('-r', '--region', help = 'region to process, chr:start-end (optional)', type=str, required=False)
 args = parser.parse_args()
 
-# check if samples names are given and if all sample names are present in a header
-sampleNames = calls.checkSampleNames(args.samples, args.input)
+if args.seed is not None:
+  np.random.seed(args.seed)
+
+# define groups of samples, check if samples names are given and if all sample names are present in a header
+groups = collections.OrderedDict()
+if args.populations:
+  with open(args.populations) as popFile:
+    for line in popFile:
+      words = line.split()
+      if words:
+        groups[words[0]] = tabindex.checkSampleNames(words[1], args.input)
+elif args.samples and len(args.samples) > 1:
+  for i, samples in enumerate(args.samples):
+    groups['group%s' % (i+1)] = tabindex.checkSampleNames(samples, args.input)
+else:
+  samples = args.samples[0] if args.samples else None
+  groups['samples'] = tabindex.checkSampleNames(samples, args.input)
+
+# check the joint SFS groups
+jointGroups = []
+for joint in args.joint or []:
+  jointNames = joint.split(',')
+  if len(jointNames) < 2:
+    raise IOError('At least two groups are required for a joint SFS.\
+                   You provided "%s"' % joint)
+  for name in jointNames:
+    if name not in groups:
+      raise IOError('Group "%s" is not defined' % name)
+  jointGroups.append(jointNames)
 
 # check the missing data threshold
 if args.missing:
@@ -82,118 +140,215 @@ else:
   AlowedN = 0
   print 'The option "-m" is not specified. All sites with missing data will be skipped.'
 
-############################# program #############################
+############################# functions #############################
+
+# genotype codes that are counted as alleles
+ALLELES = 'ACGT-RYMKSW'
+ALLELE_INDEX = np.zeros(256, dtype=np.int64)
+ALLELE_INDEX.fill(-1)
+ALLELE_INDEX[[ord(a) for a in ALLELES]] = np.arange(len(ALLELES))
+
+def derivedCounts(gt, nGenotypes, ancestral):
+  ''' counts derived alleles at every site of a block,
+  returns the counts and a mask of sites that are polarized and at most biallelic'''
+  counts = genotypes.countAlleles(gt, ALLELES)
+  nAlleles = (counts > 0).sum(axis=1)
+  ancIndex = ALLELE_INDEX[ancestral]
+  ancCount = np.where(ancIndex >= 0,
+                      counts[np.arange(len(ancIndex)), np.maximum(ancIndex, 0)], 0)
+  polarized = ancestral != genotypes.N
+  informative = polarized & ((nAlleles == 1) | ((nAlleles == 2) & (ancCount > 0)))
+  return nGenotypes - ancCount, informative
+
+def subsample(derived, nGenotypes, maxGenot):
+  ''' projects derived allele counts down to maxGenot genotypes by
+  drawing from the hypergeometric distribution for all sites at once'''
+  projected = derived.copy()
+  reduced = nGenotypes != maxGenot
+  if reduced.any():
+    projected[reduced] = np.random.hypergeometric(derived[reduced],
+                                                  nGenotypes[reduced]-derived[reduced],
+                                                  maxGenot)
+  return projected
+
+def projectionTable(nSamples, maxGenot):
+  ''' creates a lookup table of hypergeometric probabilities to observe
+  0..maxGenot derived alleles among maxGenot genotypes subsampled from
+  nGenotypes genotypes with derivedCount derived alleles.
+  The table is indexed [nGenotypes-maxGenot, derivedCount, :]'''
+  logFact = np.concatenate(([0.0], np.cumsum(np.log(np.arange(1, nSamples+1)))))
+  n = np.arange(maxGenot, nSamples+1)[:, None, None]
+  d = np.arange(nSamples+1)[None, :, None]
+  k = np.arange(maxGenot+1)[None, None, :]
+  valid = (d <= n) & (k <= d) & (maxGenot-k <= n-d)
+  # clip indexes of invalid combinations, they are masked below
+  lf = lambda x: logFact[np.clip(x, 0, nSamples)]
+  logP = (lf(d) - lf(k) - lf(d-k) +
+          lf(n-d) - lf(maxGenot-k) - lf(n-d-maxGenot+k) -
+          (lf(n) - lf(maxGenot) - lf(n-maxGenot)))
+  return np.where(valid, np.exp(logP), 0.0)
+
+def outputName(name):
+  ''' creates the output file name of a group of samples'''
+  if len(groups) == 1:
+    return args.output
+  return "%s.%s" % (args.output, name)
 
-ref = open(args.ancestor, 'r')
-ref_header = ref.readline()
-words2 = ref.readline().split()
-ref_chr_pos = words2[0:2]
-ref_ch = int(ref_chr_pos[0].split('_')[1])
-ref_pos = int(ref_chr_pos[1])
-ancest = words2[2]
+def writeSFS(SFSnum, outputFile):
+  ''' writes the non-zero classes of the SFS'''
+  output = bgzf.openFile(outputFile, 'w')
+  output.write("Derived-allele-freq\tNumber-of-sites\n")
+  for key in np.flatnonzero(SFSnum):
+    output.write("%s\t%s\n" % (key, SFSnum[key]))
+  output.close()
+
+def writeJointSFS(jointSFS, names, outputFile):
+  ''' writes the non-zero classes of the joint SFS as a table
+  and the whole joint SFS as a .npy array'''
+  output = bgzf.openFile(outputFile, 'w')
+  output.write("%s\tNumber-of-sites\n" % '\t'.join(names))
+  cells = np.flatnonzero(jointSFS)
+  for index, value in zip(np.transpose(np.unravel_index(cells, jointSFS.shape)).tolist(),
+                          jointSFS.ravel()[cells].tolist()):
+    output.write("%s\t%s\n" % ('\t'.join(str(i) for i in index), value))
+  output.close()
+  np.save(outputFile+".npy", jointSFS)
+
+def expectedJointSFS(keyCounts, tables, shape):
+  ''' adds up outer products of the probability vectors of the groups
+  for all combinations of (nGenotypes, derivedCount) pairs'''
+  jointSFS = np.zeros(shape)
+  for key, count in keyCounts.items():
+    probability = np.ones(())
+    for i, table in enumerate(tables):
+      probability = np.multiply.outer(probability, table[key[2*i], key[2*i+1]])
+    jointSFS += count * probability
+  return jointSFS
 
-output = open(args.output, 'w')
+def plotSFS(SFSnum, maxGenot, outputFile):
+  ''' plots the histogram of the SFS'''
+  bins = np.arange(maxGenot+1)[1:]-0.5
+  heightF = 6
+  # increase figure width if the number of samples is too large
+  if maxGenot > 50:
+    widthF = maxGenot/5.0
+  else:
+    widthF = 8
+  plt.figure(figsize=(widthF, heightF))
+  plt.hist(np.arange(1, maxGenot), weights=SFSnum[1:maxGenot], color="grey", bins=bins)
+  plt.xlim(0.5, maxGenot-0.5)
+  plt.xticks(range(1,maxGenot, 1))
+  plt.ylabel("Number of sites")
+  plt.xlabel("Derived allele frequency")
+  plt.title(outputFile, size = 18)
+  plt.tight_layout()
+  plt.savefig(outputFile+".png", dpi=90)
+  plt.close()
+
+############################# program #############################
+
+# index or load the index of ancestral states
+ancestorStore = ancestor.loadAncestor(args.ancestor)
 
 counter = 0
-freq = []
-with open(args.input) as datafile:
+with tabindex.openTable(args.input, args.region) as datafile:
   header_line = datafile.readline()
   header_words = header_line.split()
 
-  # index samples
-  sampCol = calls.indexSamples(sampleNames, header_words)
-  maxGenot = len(sampleNames) - AlowedN
+  # index samples of all groups, each group selects its columns from the block
+  allSamples = []
+  for sampleNames in groups.values():
+    allSamples += [s for s in sampleNames if s not in allSamples]
+  sampCol = calls.indexSamples(allSamples, header_words)
+  groupState = collections.OrderedDict()
+  for name, sampleNames in groups.items():
+    nSamples = len(sampleNames)
+    maxGenot = nSamples - AlowedN
+    groupState[name] = {
+      'columns': [allSamples.index(s) for s in sampleNames],
+      'nSamples': nSamples,
+      'maxGenot': maxGenot,
+      'SFS': np.zeros(maxGenot+1, dtype=np.int64),
+      # numbers of sites per (nGenotypes, derivedCount) pair for the expected SFS
+      'pairCounts': np.zeros((AlowedN+1) * (nSamples+1), dtype=np.int64)}
+  jointSFS = []
+  for names in jointGroups:
+    shape = tuple(groupState[name]['maxGenot']+1 for name in names)
+    if args.expected:
+      # numbers of sites per combination of (nGenotypes, derivedCount) pairs
+      jointSFS.append(collections.Counter())
+    else:
+      jointSFS.append(np.zeros(shape, dtype=np.int64))
 
-  for line in datafile:
-    words = line.split()
-    ch = int(words[0].split('_')[1])
-    pos = int(words[1])
+  for chroms, positions, genotypesAll in genotypes.readBlocks(datafile, sampCol, len(header_words)):
 
     # track progress
-    counter += 1
-    if counter % 1000000 == 0:
+    counter += len(positions)
+    if counter % 1000000 < len(positions):
       print str(counter), "lines processed"
-      
-    # select samples
-    genotypesN = calls.selectSamples(sampCol, words)
-    
-    # skip sites with missing data
-    numN =  calls.countPerPosition(genotypesN, 'N')
-    if numN <= AlowedN: 
-      genotypes = [i for i in genotypesN if i != 'N']
-      nGenotypes = len(genotypes)
-    else:
-      continue # skip lines with too many Ns
-    
-    # count alleles
-    numAl = collections.Counter(genotypes)
-    numAlM = numAl.most_common()
-
-    while ch > ref_ch or (ch == ref_ch and pos > ref_pos):
-      words2 = ref.readline().split()
-      if words2 == []:
-        ancest = 'N'
-        break
+
+    # find the ancestral states
+    ancestral = ancestor.lookupAncestor(ancestorStore, chroms, positions)
+
+    for name, g in groupState.items():
+      genotypesN = genotypesAll[:, g['columns']]
+      maxGenot = g['maxGenot']
+
+      # skip sites with missing data
+      numN = genotypes.countPerSite(genotypesN, 'N')
+      nGenotypes = g['nSamples'] - numN
+
+      # count derived alleles and skip unpolarized and multiallelic sites
+      derived, informative = derivedCounts(genotypesN, nGenotypes, ancestral)
+      informative &= numN <= AlowedN
+      g['nGenotypes'] = nGenotypes
+      g['derived'] = derived
+      g['informative'] = informative
+
+      if args.expected:
+        pair = (nGenotypes[informative]-maxGenot)*(g['nSamples']+1) + derived[informative]
+        g['pairCounts'] += np.bincount(pair, minlength=len(g['pairCounts']))
       else:
-        ref_chr_pos = words2[0:2]
-        ref_ch = int(ref_chr_pos[0].split('_')[1])
-        ref_pos = int(ref_chr_pos[1])
-        ancest = words2[2]
- 
-    if ancest == 'N':  # skip unpolarized sites
-      continue
-    elif len(numAl) == 1:  # if fixed
-      al1 = numAlM[0][0]
-      if al1 == ancest:
-        freq.append(0)
+        # subsample sites with missing data
+        projected = np.zeros(len(derived), dtype=np.int64)
+        projected[informative] = subsample(derived[informative], nGenotypes[informative], maxGenot)
+        g['SFS'] += np.bincount(projected[informative], minlength=maxGenot+1)
+        g['projected'] = projected
+
+    for names, joint in zip(jointGroups, jointSFS):
+      gs = [groupState[name] for name in names]
+      # the derived allele must be the same in all groups
+      pooled = genotypesAll[:, sum([g['columns'] for g in gs], [])]
+      pooledDerived, shared = derivedCounts(
+        pooled, np.zeros(len(pooled), dtype=np.int64), ancestral)
+      for g in gs:
+        shared &= g['informative']
+      if args.expected:
+        keys = np.column_stack(sum([[g['nGenotypes'][shared]-g['maxGenot'],
+                                     g['derived'][shared]] for g in gs], []))
+        if len(keys):
+          uniqueKeys, keyCounts = np.unique(keys, axis=0, return_counts=True)
+          joint.update(dict(zip(map(tuple, uniqueKeys.tolist()), keyCounts.tolist())))
       else:
-        n1 = numAlM[0][1]
-        x1 = np.random.hypergeometric(n1, nGenotypes-n1, maxGenot, 1)[0] # subsample
-        freq.append(x1)
-    elif len(numAl) == 2:  # if biallelic
-      al1 = numAlM[0][0]
-      al2 = numAlM[1][0]
-      if al2 == ancest:
-        if nGenotypes == maxGenot:
-          x1 = numAlM[0][1]
-        else:
-          n1 = numAlM[0][1]
-          x1 = np.random.hypergeometric(n1, nGenotypes-n1, maxGenot, 1)[0] # subsample
-        freq.append(x1)
-      elif al1 == ancest:
-        if nGenotypes == maxGenot:
-          x2 = numAlM[1][1]
-        else:
-          n2 = numAlM[1][1]
-          x2 = np.random.hypergeometric(n2, nGenotypes-n2, maxGenot, 1)[0] # subsample
-        freq.append(x2)
-
-  SFSnum = collections.Counter(freq)
-  SFSnumS = collections.OrderedDict(sorted(SFSnum.items()))
-  output.write("Derived-allele-freq\tNumber-of-sites\n")
-  for key, value in SFSnumS.items():
-    output.write("%s\t%s\n" % (key, value))
-
-# Plot frequency
-bins = np.arange(maxGenot+1)[1:]-0.5
-heightF = 6
-# increase figure width if the number of samples is too large
-if maxGenot > 50:
-  widthF = maxGenot/5.0
-else:
-  widthF = 8
-plt.figure(figsize=(widthF, heightF))
-plt.hist(freq, color="grey", bins=bins)
-plt.xlim(0.5, maxGenot-0.5)
-plt.xticks(range(1,maxGenot, 1))
-plt.ylabel("Number of sites")
-plt.xlabel("Derived allele frequency")
-plt.title(args.output, size = 18)
-plt.tight_layout()
-plt.savefig(args.output+".png", dpi=90)
-plt.close()
+        cell = np.ravel_multi_index([g['projected'][shared] for g in gs], joint.shape)
+        joint += np.bincount(cell, minlength=joint.size).reshape(joint.shape)
+
+for name, g in groupState.items():
+  SFSnum = g['SFS']
+  if args.expected:
+    # add up the probability vectors of all (nGenotypes, derivedCount) pairs
+    table = projectionTable(g['nSamples'], g['maxGenot']).reshape(len(g['pairCounts']), g['maxGenot']+1)
+    SFSnum = np.round(g['pairCounts'].dot(table), 4)
+  writeSFS(SFSnum, outputName(name))
+  # Plot frequency
+  plotSFS(SFSnum, g['maxGenot'], outputName(name))
+
+for names, joint in zip(jointGroups, jointSFS):
+  if args.expected:
+    gs = [groupState[name] for name in names]
+    tables = [projectionTable(g['nSamples'], g['maxGenot']) for g in gs]
+    joint = np.round(expectedJointSFS(joint, tables, [g['maxGenot']+1 for g in gs]), 4)
+  writeJointSFS(joint, names, "%s.%s" % (args.output, '-'.join(names)))
 
 datafile.close()
-output.close()
-ref.close()
 print('Done!')
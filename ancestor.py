@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+'''
+Indexed ancestral-state store.
+
+The ancestor file is parsed once into a compact index: one array of
+positions sorted within each chromosome, one uint8 array of ancestral bases
+and a table of chromosome ranges. The index is saved next to the ancestor
+file (ancestor.file.anc/) and memory-mapped by later runs, so SFS.py and
+mutMatrix.py do not re-read the ancestor file for every set of samples.
+Chromosome names can be arbitrary and the ancestor file can be compressed.
+
+#Example ancestor file:
+
+#CHROM  POS    Ancestor
+scaffold_1  585 A
+scaffold_1  586 G
+scaffold_1  587 G
+
+#Example:
+
+import ancestor
+
+store = ancestor.loadAncestor('ancestor.file')
+ancestral = ancestor.lookupAncestor(store, chroms, positions)
+
+where chroms and positions are arrays of a block of sites, and ancestral is
+a uint8 array of ancestral bases with 'N' for sites absent from the file.
+
+#contact:
+
+Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
+
+'''
+
+############################# modules #############################
+
+import bgzf # compressed input
+import os
+import genotypes # block reader of calls tables
+import numpy as np
+import sys
+
+############################# functions #############################
+
+def indexName(ancestorFile):
+    ''' returns the directory name of the index of an ancestor file'''
+    return ancestorFile + '.anc'
+
+
+def buildAncestor(ancestorFile):
+    ''' parses an ancestor file into chromosome ranges, positions and bases'''
+    chromPos = {}
+    chromBases = {}
+    chromOrder = []
+    with bgzf.openFile(ancestorFile) as ref:
+        ref_header = ref.readline()
+        for tokens in genotypes.readTokenBlocks(ref, len(ref_header.split())):
+            chroms = tokens[:, 0]
+            # split the block at chromosome boundaries
+            bounds = np.flatnonzero(chroms[1:] != chroms[:-1]) + 1
+            for s, e in zip(np.r_[0, bounds], np.r_[bounds, len(chroms)]):
+                Chr = chroms[s]
+                if Chr not in chromPos:
+                    chromOrder.append(Chr)
+                    chromPos[Chr] = []
+                    chromBases[Chr] = []
+                chromPos[Chr].append(tokens[s:e, 1].astype(np.int64))
+                chromBases[Chr].append(genotypes.genotypeCodes(tokens[s:e, 2]))
+    ranges = []
+    positions = []
+    bases = []
+    start = 0
+    for Chr in chromOrder:
+        pos = np.concatenate(chromPos.pop(Chr))
+        base = np.concatenate(chromBases.pop(Chr))
+        order = np.argsort(pos, kind='mergesort')
+        positions.append(pos[order])
+        bases.append(base[order])
+        ranges.append((Chr, start, start + len(pos)))
+        start += len(pos)
+    if not ranges:
+        return {'chromosomes': {}, 'positions': np.zeros(0, dtype=np.int64),
+                'bases': np.zeros(0, dtype=np.uint8)}
+    return {'chromosomes': dict((c, (s, e)) for c, s, e in ranges),
+            'positions': np.concatenate(positions),
+            'bases': np.concatenate(bases)}
+
+
+def _writeFile(fileName, write):
+    ''' writes a file under a temporary name with write(file) and renames it,
+    so that concurrent runs never see a partial file'''
+    tmpName = '%s.%s.tmp' % (fileName, os.getpid())
+    with open(tmpName, 'wb') as output:
+        write(output)
+    os.rename(tmpName, fileName)
+
+
+def saveAncestor(store, indexDir):
+    ''' writes an ancestral-state store to a directory of .npy files,
+    chromosomes.txt is written last and marks a complete index'''
+    if not os.path.isdir(indexDir):
+        try:
+            os.makedirs(indexDir)
+        except OSError:
+            # created by a concurrent run
+            if not os.path.isdir(indexDir):
+                raise
+    _writeFile(os.path.join(indexDir, 'positions.npy'),
+               lambda output: np.save(output, store['positions']))
+    _writeFile(os.path.join(indexDir, 'bases.npy'),
+               lambda output: np.save(output, store['bases']))
+    ranges = sorted(store['chromosomes'].items(), key=lambda x: x[1])
+    _writeFile(os.path.join(indexDir, 'chromosomes.txt'),
+               lambda output: output.write(''.join("%s\t%s\t%s\n" % (Chr, start, end)
+                                                   for Chr, (start, end) in ranges)))
+
+
+def readAncestor(indexDir):
+    ''' memory-maps an ancestral-state store saved with saveAncestor()'''
+    chromosomes = {}
+    with open(os.path.join(indexDir, 'chromosomes.txt')) as chromFile:
+        for line in chromFile:
+            Chr, start, end = line.split()
+            chromosomes[Chr] = (int(start), int(end))
+    return {'chromosomes': chromosomes,
+            'positions': np.load(os.path.join(indexDir, 'positions.npy'),
+                                 mmap_mode='r'),
+            'bases': np.load(os.path.join(indexDir, 'bases.npy'),
+                             mmap_mode='r')}
+
+
+def loadAncestor(ancestorFile):
+    ''' loads the index of an ancestor file, builds it if it is absent
+    or older than the ancestor file'''
+    indexDir = indexName(ancestorFile)
+    chromFile = os.path.join(indexDir, 'chromosomes.txt')
+    if (os.path.exists(chromFile) and
+            os.path.getmtime(chromFile) >= os.path.getmtime(ancestorFile)):
+        return readAncestor(indexDir)
+    sys.stderr.write('Indexing the ancestor file...\n')
+    store = buildAncestor(ancestorFile)
+    try:
+        saveAncestor(store, indexDir)
+    except (IOError, OSError):
+        sys.stderr.write('WARNING: the ancestor index could not be saved to %s\n' % indexDir)
+    return store
+
+
+def lookupAncestor(store, chroms, positions):
+    ''' returns ancestral bases (uint8 codes) for arrays of chromosomes and
+    positions, 'N' for sites that are absent from the ancestor file'''
+    ancestral = np.empty(len(positions), dtype=np.uint8)
+    ancestral.fill(genotypes.N)
+    if len(positions) == 0:
+        return ancestral
+    # blocks are sorted by chromosome, so process runs of the same chromosome
+    bounds = np.flatnonzero(chroms[1:] != chroms[:-1]) + 1
+    for s, e in zip(np.r_[0, bounds], np.r_[bounds, len(chroms)]):
+        if chroms[s] not in store['chromosomes']:
+            continue
+        start, end = store['chromosomes'][chroms[s]]
+        if start == end:
+            continue
+        refPos = store['positions'][start:end]
+        idx = np.searchsorted(refPos, positions[s:e])
+        idx = np.minimum(idx, len(refPos) - 1)
+        found = refPos[idx] == positions[s:e]
+        ancestral[s:e][found] = store['bases'][start:end][idx[found]]
+    return ancestral
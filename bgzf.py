@@ -0,0 +1,275 @@
+#! /usr/bin/env python
+'''
+Transparent reading and writing of plain, gzip and bgzip compressed files.
+
+openFile() detects the compression of an input file from its first bytes.
+BGZF files (bgzip, the format of tabix and samtools) are sequences of small
+gzip blocks, so they are decompressed block-parallel: batches of blocks are
+inflated in worker threads while the previous batch is parsed. zlib releases
+the GIL, so the threads run in parallel. Positions in BGZF files are virtual
+offsets (block offset << 16 | offset in block), which allows the table index
+(tabindex.py) to seek in compressed files. Plain gzip files are read as a
+single stream.
+
+Output files with names ending in .gz are written in the BGZF format, which
+is readable by gzip, zcat and bgzip.
+
+#Example:
+
+import bgzf
+
+with bgzf.openFile('input.tab.gz') as datafile:
+    header_line = datafile.readline()
+    for line in datafile:
+        ...
+
+outputFile = bgzf.openFile('output.tab.gz', 'w')
+
+#contact:
+
+Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
+
+'''
+
+############################# modules #############################
+
+import gzip
+import multiprocessing
+import struct
+import zlib
+from multiprocessing.pool import ThreadPool
+
+############################# constants #############################
+
+THREADS = min(4, multiprocessing.cpu_count())  # threads to (de)compress blocks
+BATCH_BLOCKS = 64  # blocks (de)compressed per thread and batch
+BLOCK_DATA = 0xff00  # uncompressed bytes per BGZF block, as in bgzip
+COMPRESS_LEVEL = 6
+
+GZIP_MAGIC = '\x1f\x8b'
+EOF_BLOCK = ('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43'
+             '\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+############################# functions #############################
+
+def fileFormat(fileName):
+    ''' returns "bgzf", "gzip" or "text" depending on the file compression'''
+    with open(fileName, 'rb') as raw:
+        header = raw.read(18)
+    if not header.startswith(GZIP_MAGIC):
+        return 'text'
+    # BGZF blocks have the extra field flag and a "BC" subfield
+    if len(header) == 18 and ord(header[3]) & 4 and header[12:14] == 'BC':
+        return 'bgzf'
+    return 'gzip'
+
+
+def _readBlock(raw):
+    ''' reads one BGZF block, returns its offset, compressed data and
+    uncompressed size, None at the end of the file'''
+    offset = raw.tell()
+    header = raw.read(12)
+    if len(header) < 12:
+        return None
+    if header[:2] != GZIP_MAGIC:
+        raise IOError('Invalid BGZF block at offset %s' % offset)
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = raw.read(xlen)
+    blockSize = None
+    i = 0
+    while i < xlen:
+        subfield = extra[i:i + 2]
+        slen = struct.unpack('<H', extra[i + 2:i + 4])[0]
+        if subfield == 'BC':
+            blockSize = struct.unpack('<H', extra[i + 4:i + 6])[0] + 1
+        i += 4 + slen
+    if blockSize is None:
+        raise IOError('Block at offset %s is not a BGZF block' % offset)
+    cdata = raw.read(blockSize - 12 - xlen - 8)
+    crc, isize = struct.unpack('<II', raw.read(8))
+    return offset, cdata, isize
+
+
+def _inflate(block):
+    ''' decompresses the data of a BGZF block'''
+    return zlib.decompress(block[1], -15)
+
+
+def _deflate(data):
+    ''' compresses data into a BGZF block'''
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6,
+                         66, 67, 2, len(cdata) + 25)
+    trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+    return header + cdata + trailer
+
+
+class BgzfReader(object):
+    ''' reads a BGZF file, decompressing its blocks in threads'''
+
+    def __init__(self, fileName, threads=THREADS):
+        self.raw = open(fileName, 'rb')
+        self.pool = ThreadPool(threads) if threads > 1 else None
+        self.batchSize = BATCH_BLOCKS * max(threads, 1)
+        self.seek(0)
+
+    def _readBatch(self):
+        ''' reads the compressed data of a batch of blocks'''
+        batch = []
+        while len(batch) < self.batchSize:
+            block = _readBlock(self.raw)
+            if block is None:
+                break
+            batch.append(block)
+        return batch
+
+    def _inflateBatch(self, batch):
+        ''' starts decompressing a batch of blocks'''
+        if self.pool:
+            return self.pool.map_async(_inflate, batch)
+        return [_inflate(b) for b in batch]
+
+    def _blocks(self):
+        ''' yields offsets and data of decompressed blocks, the next batch
+        is decompressed while the current one is used'''
+        batch = self._readBatch()
+        pending = self._inflateBatch(batch)
+        while batch:
+            nextBatch = self._readBatch()
+            nextPending = self._inflateBatch(nextBatch)
+            inflated = pending.get() if self.pool else pending
+            for block, data in zip(batch, inflated):
+                yield block[0], data
+            batch, pending = nextBatch, nextPending
+
+    def _fill(self):
+        ''' moves to the next non-empty block if the current one is used up,
+        returns False at the end of the file'''
+        while self.pos >= len(self.data):
+            try:
+                self.blockOffset, self.data = next(self.blocks)
+            except StopIteration:
+                self.blockOffset = self.raw.tell()
+                self.data = ''
+                self.pos = 0
+                return False
+            self.pos = 0
+        return True
+
+    def seek(self, offset):
+        ''' moves to a virtual offset'''
+        self.raw.seek(offset >> 16)
+        self.blocks = self._blocks()
+        self.blockOffset = offset >> 16
+        self.data = ''
+        self.pos = 0
+        if self._fill():
+            self.pos = offset & 0xffff
+
+    def tell(self):
+        ''' returns the virtual offset of the current position'''
+        self._fill()
+        return (self.blockOffset << 16) | self.pos
+
+    def readline(self):
+        pieces = []
+        while self._fill():
+            end = self.data.find('\n', self.pos)
+            if end >= 0:
+                pieces.append(self.data[self.pos:end + 1])
+                self.pos = end + 1
+                break
+            pieces.append(self.data[self.pos:])
+            self.pos = len(self.data)
+        return ''.join(pieces)
+
+    def __iter__(self):
+        # split whole blocks into lines, the unfinished last line of a block
+        # is carried over to the next one
+        carry = ''
+        while self._fill():
+            lines = self.data[self.pos:].split('\n')
+            self.pos = len(self.data)
+            lines[0] = carry + lines[0]
+            carry = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if carry:
+            yield carry
+
+    def close(self):
+        if self.pool:
+            self.pool.terminate()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BgzfWriter(object):
+    ''' writes a BGZF file, compressing its blocks in threads'''
+
+    def __init__(self, fileName, threads=THREADS):
+        self.raw = open(fileName, 'wb')
+        self.pool = ThreadPool(threads) if threads > 1 else None
+        self.batchData = BLOCK_DATA * BATCH_BLOCKS * max(threads, 1)
+        self.buffer = []
+        self.size = 0
+
+    def _flush(self, final=False):
+        ''' compresses the buffered data, the last incomplete block is kept
+        in the buffer unless it is the end of the file'''
+        data = ''.join(self.buffer)
+        nBlocks = len(data) // BLOCK_DATA
+        if final and len(data) % BLOCK_DATA:
+            nBlocks += 1
+        chunks = [data[i * BLOCK_DATA:(i + 1) * BLOCK_DATA]
+                  for i in range(nBlocks)]
+        rest = data[nBlocks * BLOCK_DATA:]
+        self.buffer = [rest]
+        self.size = len(rest)
+        if self.pool:
+            blocks = self.pool.map(_deflate, chunks)
+        else:
+            blocks = [_deflate(c) for c in chunks]
+        self.raw.write(''.join(blocks))
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= self.batchData:
+            self._flush()
+
+    def close(self):
+        if self.raw.closed:
+            return
+        self._flush(final=True)
+        self.raw.write(EOF_BLOCK)
+        self.raw.close()
+        if self.pool:
+            self.pool.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def openFile(fileName, mode='r', threads=THREADS):
+    ''' opens a plain, gzip or BGZF file for reading, detecting the
+    compression, or a file for writing, BGZF if its name ends with .gz'''
+    if mode.startswith('w'):
+        if fileName.endswith('.gz') or fileName.endswith('.bgz'):
+            return BgzfWriter(fileName, threads)
+        return open(fileName, mode)
+    compression = fileFormat(fileName)
+    if compression == 'bgzf':
+        return BgzfReader(fileName, threads)
+    elif compression == 'gzip':
+        return gzip.open(fileName, 'rb')
+    return open(fileName, mode)
@@ -49,6 +49,12 @@ chr1	19797	54	32	44	57	49
 
 $ python calculate_AveragePerWindow.py -i input.tab -o output.tab -w 5000
 
+With --step the windows overlap: a window of size -w starts every step bp, (k*step, k*step+w]. Windows without sites are skipped.
+
+With --sites N the windows have N informative sites (sites with at least one value) instead of a size in bp. The first and the last positions of every window are written after POS, the last window of a chromosome can have fewer sites.
+
+Chromosomes can be processed in parallel with -T (number of processes). The lines of every chromosome must be contiguous in the input file.
+
 #contact:
 
 Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
@@ -57,7 +63,11 @@ Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
 
 ############################# modules #############################
 
+import bgzf  # compressed input and output
 import calls  # my custom module
+import StringIO
+import tabindex  # index of tables, region queries and parallel processing
+import windows  # sliding window engine
 
 ############################# options #############################
 
@@ -67,116 +77,86 @@ parser.add_argument(
 parser.add_argument(
     '-o', '--output', help='name of the output file', type=str, required=True)
 parser.add_argument(
-    '-w', '--window', help='sliding window size', type=int, required=True)
+    '-w', '--window', help='sliding window size', type=int, required=False)
+parser.add_argument(
+    '--sites', help='number of informative sites per window, instead of -w',
+    type=int, required=False)
+parser.add_argument(
+    '--step', help='step of overlapping windows (optional)',
+    type=int, required=False)
+parser.add_argument(
+    '-T', '--threads', help='number of processes to process chromosomes in parallel',
+    type=int, required=False, default=1)
+parser.add_argument(
+    '-r', '--region', help='region to process, chr:start-end (optional)',
+    type=str, required=False)
 args = parser.parse_args()
 
 ############################# functions #############################
 
-def meanWindow(dictList):
-    ''' calculates mean of a window'''
-    for k in dictList:
-        values = []
-        for val in dictList[k]:
-            if val != 'NA' and val != "Inf" and val != "-Inf":
-                values.append(float(val))
-        if len(values) > 0:
-            averageValue = sum(values) / len(values)
-            dictList[k] = averageValue
+def processLines(lines, outputFile, resumed=False):
+    ''' calculates mean values per window for the lines of the input file,
+    resumed is True if the lines start after a chromosome change'''
+    blocks = windows.readValueBlocks(lines, len(header_words))
+    if args.sites:
+        for Chr, posS, posE, window in windows.slideSites(blocks, args.sites):
+            meanValWindowP = '%s\t%s\t%s' % (posS, posE,
+                                             windows.formatValues(window.mean()))
+            calls.processWindow(Chr, posS, posE, meanValWindowP, outputFile)
+        return
+    if args.step:
+        for Chr, posS, posE, window in windows.slideSteps(blocks, windSize,
+                                                          args.step):
+            meanValWindowP = windows.formatValues(window.mean())
+            calls.processWindow(Chr, posS, posE, meanValWindowP, outputFile)
+        return
+    for Chr, posS, posE, values in windows.slideWindows(blocks, windSize,
+                                                        resumed=resumed):
+        if values is None:
+            meanValWindowP = '\t'.join('NA' for s in sampleNames)
         else:
-            dictList[k] = 'NA'
-    return dictList
-
-def createNewDict(NamesList):
-    ''' creates a new empty dictionary with sample names as keys'''
-    newDict = {}
-    for k in NamesList:
-        newDict[k] = []
-    return newDict
-
-def printWindow(inputDict, orderedNames):
-    ''' creates print string from a dictionary with mean values'''
-    newList = []
-    for n in orderedNames:
-        newList.append(inputDict[n])
-    newListP = '\t'.join(str(el) for el in newList)
-    return newListP
+            meanValWindowP = windows.formatValues(windows.windowMean(values))
+        calls.processWindow(Chr, posS, posE, meanValWindowP, outputFile)
+
+
+def processShard(fileName, start, end, resumed):
+    ''' calculates mean values per window for one chromosome of the input file'''
+    output = StringIO.StringIO()
+    processLines(tabindex.readRange(fileName, start, end), output, resumed)
+    return output.getvalue()
+
 
 ############################# program #############################
 
 print('Opening the file...')
 
 windSize = args.window
-windPosEnd = windSize
-counter = 0
+if not windSize and not args.sites:
+    raise IOError('Window size (-w) or number of sites (--sites) is required')
 
-with open(args.input) as datafile:
+with tabindex.openTable(args.input, args.region) as datafile:
     header_line = datafile.readline()
 
     # make output header
-    outputFile = open(args.output, 'w')
-    outputFile.write(header_line)
+    outputFile = bgzf.openFile(args.output, 'w')
+    header_words = header_line.split()
+    if args.sites:
+        # windows of sites report their first and last positions
+        outputFile.write('%s\tstart\tend\t%s\n' % ('\t'.join(header_words[:2]),
+                                                  '\t'.join(header_words[2:])))
+    else:
+        outputFile.write(header_line)
 
     # make samples dict
-    header_words = header_line.split()
     sampleNames = header_words[2:]
-    windowDict = createNewDict(sampleNames)
 
     print('Processing the data  ...')
 
-    ChrPrevious = ''
-    posS = ''
-    posE = ''
-    for line in datafile:
-        words = line.split()
-        Chr = words[0]
-        pos = int(float(words[1]))
-        indVal = words[2:]
-
-        # to store the values of a previous line
-        if not ChrPrevious:
-            ChrPrevious = Chr
-        if not posS:
-            posS = windPosEnd - windSize
-        if not posE:
-            posE = windPosEnd
-
-        # if window size is reached output the results
-        if Chr != ChrPrevious:  # if end of a chromosome
-            meanValWindow = meanWindow(windowDict)
-            meanValWindowP = printWindow(meanValWindow, sampleNames)
-            calls.processWindow(ChrPrevious, posS, posE,
-                                meanValWindowP, outputFile)
-            windPosEnd = windSize
-            windowDict = createNewDict(sampleNames)
-            posS = windPosEnd - windSize
-        elif pos > windPosEnd:  # if end of a window
-            meanValWindow = meanWindow(windowDict)
-            meanValWindowP = printWindow(meanValWindow, sampleNames)
-            calls.processWindow(Chr, posS, posE,
-                                meanValWindowP, outputFile)
-            windPosEnd = windPosEnd + windSize
-            windowDict = createNewDict(sampleNames)
-            posS = windPosEnd - windSize
-            while pos > windPosEnd:  # gap is larger than window size
-                windPosEnd = windPosEnd + windSize
-
-        ChrPrevious = Chr
-        posE = windPosEnd
-
-        # append values
-        for s in xrange(len(sampleNames)):
-            windowDict[sampleNames[s]].append(indVal[s])
-
-        # track progress
-        counter += 1
-        if counter % 1000000 == 0:
-            print str(counter), "lines processed"
-
-# process the last window
-meanValWindow = meanWindow(windowDict)
-meanValWindowP = printWindow(meanValWindow, sampleNames)
-calls.processWindow(Chr, posS, windPosEnd,
-                    meanValWindowP, outputFile)
+    if args.threads > 1 and not args.region:
+        for text in tabindex.runSharded(args.input, processShard, args.threads):
+            outputFile.write(text)
+    else:
+        processLines(datafile, outputFile)
 
 datafile.close()
 outputFile.close()
@@ -51,6 +51,12 @@ chr_3   3.0 0.0
 
 $ python calculate_FixedHetero_PerWindow.py -i input.tab -o output.tab -w 5 -m 6 -s "sample1,sample2,sample3,sample4,sample5,sample6,sample7,sample8"
 
+With --step the windows overlap: a window of size -w starts every step bp, (k*step, k*step+w]. Windows without sites are skipped.
+
+With --sites N the windows have N counted sites (sites with few enough Ns) instead of a size in bp. The first and the last positions of every window are written after POS, the last window of a chromosome can have fewer sites.
+
+Chromosomes can be processed in parallel with -T (number of processes). The lines of every chromosome must be contiguous in the input file.
+
 #contact:
 
 Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
@@ -59,7 +65,13 @@ Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
 
 ############################# modules #############################
 
+import bgzf # compressed input and output
 import calls # my custom module
+import genotypes # block reader of calls tables
+import numpy as np
+import StringIO
+import tabindex # index of tables, region queries and parallel processing
+import windows # sliding window engine
 
 ############################# options #############################
 
@@ -67,33 +79,76 @@ parser = calls.CommandLineParser()
 parser.add_argument('-i', '--input', help = 'name of the input file', type=str, required=True)
 parser.add_argument('-o', '--output', help = 'name of the output file', type=str, required=True)
 parser.add_argument('-s', '--samples', help = 'column names of the samples to process (optional)', type=str, required=False)
-parser.add_argument('-w', '--window', help = 'sliding window size', type=int, required=True)
+parser.add_argument('-w', '--window', help = 'sliding window size', type=int, required=False)
+parser.add_argument('--sites', help = 'number of counted sites per window, instead of -w', type=int, required=False)
 parser.add_argument('-m', '--missing', help = 'number of allowed Ns per position ', type=int, required=False)
+parser.add_argument('--step', help = 'step of overlapping windows (optional)', type=int, required=False)
+parser.add_argument('-T', '--threads', help = 'number of processes to process chromosomes in parallel', type=int, required=False, default=1)
+parser.add_argument('-r', '--region', help = 'region to process, chr:start-end (optional)', type=str, required=False)
 args = parser.parse_args()
 
 
 # check if samples names are given and if all sample names are present in a header
-sampleNames = calls.checkSampleNames(args.samples, args.input)
+sampleNames = tabindex.checkSampleNames(args.samples, args.input)
 
 ############################# functions #############################
 
-def meanWindow(hetero, total):
+def meanWindow(counts):
   ''' calculates mean of a window'''
+  if counts is None:  # if all sites are missing data
+    return 'NA'
+  hetero, total = windows.windowSum(counts).tolist()
   if total:
-    propHetero = hetero/total
-  else:  # is all sites are missing data
+    propHetero = round(hetero/total, 4)
+  else:
     propHetero = 'NA'
   return propHetero
 
+def countBlocks(lines):
+  ''' yields chromosome, position and counts of fixed heterozygous sites and counted sites
+  for blocks of sites, sites with too many Ns are not counted'''
+  for Chrs, positions, sample_charaters in genotypes.readBlocks(lines, sampCol, len(header_words)):
+    Nmising = genotypes.countPerSite(sample_charaters, 'N')
+    counted = Nmising <= allowedN # skip if too many Ns
+    fixedHetero = genotypes.isFixedHeteroPerSite(sample_charaters)
+    yield Chrs, positions, np.column_stack([fixedHetero & counted, counted])
+
+def countedSites(counts):
+  ''' sites that are not skipped for too many Ns'''
+  return counts[:, 1] > 0
+
+def processLines(lines, outputFile, resumed=False):
+  ''' calculates fixed heterozygosity per window for the lines of the input file,
+  resumed is True if the lines start after a chromosome change'''
+  if args.sites:
+    for Chr, posS, posE, window in windows.slideSites(countBlocks(lines), args.sites, countedSites):
+      hetero, total = window.sums.astype(float).tolist()
+      calls.processWindow(Chr, posS, posE, '%s\t%s\t%s' % (posS, posE, round(hetero/total, 4)), outputFile)
+    return
+  if args.step:
+    for Chr, posS, posE, window in windows.slideSteps(countBlocks(lines), windSize, args.step, siteBounds=True):
+      hetero, total = window.sums.astype(float).tolist()
+      calls.processWindow(Chr, posS, posE, round(hetero/total, 4) if total else 'NA', outputFile)
+    return
+  for Chr, posS, posE, counts in windows.slideWindows(countBlocks(lines), windSize, resumed=resumed, siteBounds=True):
+    calls.processWindow(Chr, posS, posE, meanWindow(counts), outputFile)
+
+def processShard(fileName, start, end, resumed):
+  ''' calculates fixed heterozygosity per window for one chromosome of the input file'''
+  output = StringIO.StringIO()
+  processLines(tabindex.readRange(fileName, start, end), output, resumed)
+  return output.getvalue()
+
+
 ############################# program #############################
 
 print('Opening the file...')
 
 windSize = args.window
-windPosEnd = windSize
-counter = 0
+if not windSize and not args.sites:
+  raise IOError('Window size (-w) or number of sites (--sites) is required')
 
-with open(args.input) as datafile:
+with tabindex.openTable(args.input, args.region) as datafile:
   header_line = datafile.readline()
   header_words = header_line.split()
   
@@ -109,83 +164,22 @@ with open(args.input) as datafile:
   nSample = len(sampleNames)
 
   # make output header
-  outputFile = open(args.output, 'w')
-  outputFile.write("CHROM\tPOS\tHeter\n")
+  outputFile = bgzf.openFile(args.output, 'w')
+  if args.sites:
+    # windows of sites report their first and last positions
+    outputFile.write("CHROM\tPOS\tstart\tend\tHeter\n")
+  else:
+    outputFile.write("CHROM\tPOS\tHeter\n")
 
 ############################## perform counting ####################
 
   print('Counting heterozygots ...')
 
-  Hwindow = 0
-  Twindow = 0
-  ChrPrevious = ''
-  posS = ''
-  posE = ''
-  for line in datafile:
-    words = line.split()
-    Chr = words[0]
-    pos = int(words[1])
-
-    # to store the values of a previous line
-    if not ChrPrevious:
-      ChrPrevious = Chr
-    if not posS:
-      posS = pos
-    if not posE:
-      posE = pos
-
-    # select samples
-    sample_charaters = calls.selectSamples(sampCol, words)
-
-    # check if one- or two-character code
-    if any(["/" in gt for gt in sample_charaters]):
-      sample_charaters = calls.twoToOne(sample_charaters)
-
-    # if window size is reached output the results
-    if Chr > ChrPrevious:  # if end of a chromosome
-      try:
-        HeterWindow = round(meanWindow(Hwindow, Twindow), 4)
-      except Exception:
-        HeterWindow = "NA"
-      calls.processWindow(ChrPrevious, posS, posE, HeterWindow, outputFile)
-      windPosEnd = windSize
-      Hwindow = 0
-      Twindow = 0
-      posS = pos
-    elif pos > windPosEnd:  # if end of a window
-      try:
-        HeterWindow = round(meanWindow(Hwindow, Twindow), 4)
-      except Exception:
-        HeterWindow = "NA"
-      calls.processWindow(Chr, posS, posE, HeterWindow, outputFile)
-      windPosEnd = windPosEnd+windSize
-      Hwindow = 0
-      Twindow = 0
-      posS = pos
-      while pos > windPosEnd:  # if the gap in positions is larger than window size
-        windPosEnd = windPosEnd+windSize
-
-    ChrPrevious = Chr
-    posE = pos
-
-    # count hetero
-    Nmising = calls.countPerPosition(sample_charaters, 'N')
-    if Nmising <= allowedN:  # skip if too many Ns
-      if calls.if_FixedHetero(sample_charaters):
-        Hwindow += 1.0
-      Twindow += 1.0
-
-    # track progress
-    counter += 1
-    if counter % 1000000 == 0:
-      print str(counter), "lines processed"
-
-# process the last window
-try:
-  HeterWindow = round(meanWindow(Hwindow, Twindow), 4)
-except Exception:
-  HeterWindow = "NA"
-calls.processWindow(Chr, posS, pos, HeterWindow, outputFile)
+  if args.threads > 1 and not args.region:
+    for text in tabindex.runSharded(args.input, processShard, args.threads):
+      outputFile.write(text)
+  else:
+    processLines(datafile, outputFile)
 
 datafile.close()
 outputFile.close()
@@ -52,6 +52,21 @@ chr_3   3.0 4.2
 
 $ python calculate_Hetero_PerWindow.py -i input.tab -o output.tab -w 5 -s "sample1,sample2,sample3,sample4,sample5,sample6,sample7,sample8"
 
+With --step the windows overlap: a window of size -w starts every step bp, (k*step, k*step+w]. Windows without sites are skipped.
+
+With --sites N the windows have N counted sites (sites with few enough Ns) instead of a size in bp. The first and the last positions of every window are written after POS, the last window of a chromosome can have fewer sites.
+
+With --per-sample the heterozygosity of every sample is written in its own column, the sites with too many Ns (-m) are skipped for all samples.
+With --total-output the genome-wide heterozygosity of every sample (the sum of the counts of all sites) is written to
+a second file in the same pass, as with calculate_Total-Hetero.py --per-sample but without the sites skipped by -m:
+
+sample  Heter
+sample1 0.2727
+sample2 0.1111
+...
+
+Chromosomes can be processed in parallel with -T (number of processes). The lines of every chromosome must be contiguous in the input file.
+
 #contact:
 
 Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
@@ -60,7 +75,13 @@ Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
 
 ############################# modules #############################
 
+import bgzf # compressed input and output
 import calls # my custom module
+import genotypes # block reader of calls tables
+import numpy as np
+import StringIO
+import tabindex # index of tables, region queries and parallel processing
+import windows # sliding window engine
 
 ############################# options #############################
 
@@ -68,33 +89,90 @@ parser = calls.CommandLineParser()
 parser.add_argument('-i', '--input', help = 'name of the input file', type=str, required=True)
 parser.add_argument('-o', '--output', help = 'name of the output file', type=str, required=True)
 parser.add_argument('-s', '--samples', help = 'column names of the samples to process (optional)', type=str, required=False)
-parser.add_argument('-w', '--window', help = 'sliding window size', type=int, required=True)
+parser.add_argument('-w', '--window', help = 'sliding window size', type=int, required=False)
+parser.add_argument('--sites', help = 'number of counted sites per window, instead of -w', type=int, required=False)
 parser.add_argument('-m', '--missing', help = 'number of allowed Ns per position ', type=int, required=False)
+parser.add_argument('--step', help = 'step of overlapping windows (optional)', type=int, required=False)
+parser.add_argument('--per-sample', help = 'heterozygosity of every sample instead of all samples together', action='store_true', required=False)
+parser.add_argument('--total-output', help = 'name of the output file of the genome-wide heterozygosity of every sample (with --per-sample)', type=str, required=False)
+parser.add_argument('-T', '--threads', help = 'number of processes to process chromosomes in parallel', type=int, required=False, default=1)
+parser.add_argument('-r', '--region', help = 'region to process, chr:start-end (optional)', type=str, required=False)
 args = parser.parse_args()
 
 
 # check if samples names are given and if all sample names are present in a header
-sampleNames = calls.checkSampleNames(args.samples, args.input)
+sampleNames = tabindex.checkSampleNames(args.samples, args.input)
 
 ############################# functions #############################
 
-def meanWindow(hetero, total):
-  ''' calculates mean of a window'''
-  if total:
-    propHetero = sum(hetero)/sum(total)
-  else:  # is all sites are missing data
-    propHetero = 'NA'
-  return propHetero
+def heteroWindow(window):
+  ''' calculates proportions of heterozygous genotypes of a window from its sums,
+  the counts of heterozygous genotypes are followed by the counts of called genotypes'''
+  hetero, total = np.split(window.sums.astype(float), 2)
+  return '\t'.join(str(round(h/t, 4)) if t else 'NA' for h, t in zip(hetero.tolist(), total.tolist()))
+
+def countBlocks(lines, totals):
+  ''' yields chromosome, position and counts of heterozygous and called genotypes
+  for blocks of sites, per site or per sample and site, sites with too many Ns are not counted.
+  The counts of all sites are also added to totals'''
+  for Chrs, positions, sample_charaters in genotypes.readBlocks(lines, sampCol, len(header_words)):
+    Nmising = genotypes.countPerSite(sample_charaters, 'N')
+    counted = Nmising < allowedN # skip if too many Ns
+    if args.per_sample:
+      counts = np.hstack([genotypes.isHetero(sample_charaters), genotypes.isCalled(sample_charaters)])
+    else:
+      nHerer = genotypes.countHeteroPerSite(sample_charaters)
+      nTotal = nSample - Nmising
+      counts = np.column_stack([nHerer, nTotal])
+    counts = counts * counted[:, None]
+    totals += counts.sum(axis=0)
+    yield Chrs, positions, counts
+
+def countedSites(counts):
+  ''' sites that are not skipped for too many Ns'''
+  return counts[:, counts.shape[1]//2:].any(axis=1)
+
+def newWindow():
+  ''' creates the sums of a window'''
+  return windows.WindowSums(2*len(heteroNames))
+
+def newTotals():
+  ''' creates the genome-wide counts of heterozygous and called genotypes'''
+  return np.zeros(2*len(heteroNames), dtype=np.int64)
+
+def processLines(lines, outputFile, totals, resumed=False):
+  ''' calculates heterozygosity per window for the lines of the input file and adds
+  their counts to totals, resumed is True if the lines start after a chromosome change'''
+  if args.sites:
+    for Chr, posS, posE, window in windows.slideSites(countBlocks(lines, totals), args.sites, countedSites):
+      calls.processWindow(Chr, posS, posE, '%s\t%s\t%s' % (posS, posE, heteroWindow(window)), outputFile)
+  elif args.step:
+    for Chr, posS, posE, window in windows.slideSteps(countBlocks(lines, totals), windSize, args.step, siteBounds=True):
+      calls.processWindow(Chr, posS, posE, heteroWindow(window), outputFile)
+  else:
+    for Chr, posS, posE, window in windows.slideWindows(countBlocks(lines, totals), windSize, newWindow, resumed, siteBounds=True):
+      calls.processWindow(Chr, posS, posE, heteroWindow(window), outputFile)
+
+def processShard(fileName, start, end, resumed):
+  ''' calculates heterozygosity per window for one chromosome of the input file,
+  returns the output text and the counts of the chromosome'''
+  output = StringIO.StringIO()
+  totals = newTotals()
+  processLines(tabindex.readRange(fileName, start, end), output, totals, resumed)
+  return output.getvalue(), totals
+
 
 ############################# program #############################
 
 print('Opening the file...')
 
 windSize = args.window
-windPosEnd = windSize
-counter = 0
+if not windSize and not args.sites:
+  raise IOError('Window size (-w) or number of sites (--sites) is required')
+if args.total_output and not args.per_sample:
+  raise IOError('The genome-wide output (--total-output) is written only with --per-sample')
 
-with open(args.input) as datafile:
+with tabindex.openTable(args.input, args.region) as datafile:
   header_line = datafile.readline()
   header_words = header_line.split()
   
@@ -109,87 +187,42 @@ with open(args.input) as datafile:
   # count number of sample
   nSample = len(sampleNames)
 
+  # output columns
+  if args.per_sample:
+    heteroNames = sampleNames
+  else:
+    heteroNames = ['Heter']
+
   # make output header
-  outputFile = open(args.output, 'w')
-  outputFile.write("CHROM\tPOS\tHeter\n")
+  outputFile = bgzf.openFile(args.output, 'w')
+  if args.sites:
+    # windows of sites report their first and last positions
+    outputFile.write("CHROM\tPOS\tstart\tend\t%s\n" % '\t'.join(heteroNames))
+  else:
+    outputFile.write("CHROM\tPOS\t%s\n" % '\t'.join(heteroNames))
 
 ############################## perform counting ####################
 
   print('Counting heterozygots ...')
 
-  Hwindow = []
-  Twindow = []
-  ChrPrevious = ''
-  posS = ''
-  posE = ''
-  for line in datafile:
-    words = line.split()
-    Chr = words[0]
-    pos = int(words[1])
-
-    # to store the values of a previous line
-    if not ChrPrevious:
-      ChrPrevious = Chr
-    if not posS:
-      posS = pos
-    if not posE:
-      posE = pos
-
-    # select samples
-    sample_charaters = calls.selectSamples(sampCol, words)
-
-    # check if one- or two-character code
-    if any(["/" in gt for gt in sample_charaters]):
-      sample_charaters = calls.twoToOne(sample_charaters)
-
-    # if window size is reached output the results
-    if Chr > ChrPrevious:  # if end of a chromosome
-      try:
-        HeterWindow = round(meanWindow(Hwindow, Twindow), 4)
-      except Exception:
-        HeterWindow = "NA"
-      calls.processWindow(ChrPrevious, posS, posE, HeterWindow, outputFile)
-      windPosEnd = windSize
-      Hwindow = []
-      Twindow = []
-      posS = pos
-    elif pos > windPosEnd:  # if end of a window
-      try:
-        HeterWindow = round(meanWindow(Hwindow, Twindow), 4)
-      except Exception:
-        HeterWindow = "NA"
-      calls.processWindow(Chr, posS, posE, HeterWindow, outputFile)
-      windPosEnd = windPosEnd+windSize
-      Hwindow = []
-      Twindow = []
-      posS = pos
-      while pos > windPosEnd:  # if the gap in positions is larger than window size
-        windPosEnd = windPosEnd+windSize
-
-    ChrPrevious = Chr
-    posE = pos
-
-    # count hetero
-    Nmising = calls.countPerPosition(sample_charaters, 'N')
-    if Nmising < allowedN: # skip if too many Ns
-      nHerer = calls.countHeteroPerPosition(sample_charaters)
-      nTotal = float(nSample - Nmising)
-      Hwindow.append(float(nHerer))
-      Twindow.append(float(nTotal))
-
-    # track progress
-    counter += 1
-    if counter % 1000000 == 0:
-      print str(counter), "lines processed"
-
-# process the last window
-try:
-  HeterWindow = round(meanWindow(Hwindow, Twindow), 4)
-except Exception:
-  HeterWindow = "NA"
-calls.processWindow(Chr, posS, pos, HeterWindow, outputFile)
+  totals = newTotals()
+  if args.threads > 1 and not args.region:
+    for text, shardTotals in tabindex.runSharded(args.input, processShard, args.threads):
+      outputFile.write(text)
+      totals += shardTotals
+  else:
+    processLines(datafile, outputFile, totals)
 
 datafile.close()
 outputFile.close()
+
+# genome-wide heterozygosity of every sample from the same counts as the windows
+if args.total_output:
+  totalFile = bgzf.openFile(args.total_output, 'w')
+  totalFile.write("sample\tHeter\n")
+  hetero, called = np.split(totals, 2)
+  for sample, h, c in zip(heteroNames, hetero.tolist(), called.tolist()):
+    totalFile.write("%s\t%s\n" % (sample, round(float(h)/c, 4) if c else 'NA'))
+  totalFile.close()
 print('Done!')
 
@@ -49,6 +49,12 @@ chr1	17500	54.0	32.0	44.0	56.5	48.5
 
 $ python calculate_MedianPerWindow.py -i input.tab -o output.tab -w 5000
 
+With -a (--approximate) the medians are estimated with the P-square algorithm,
+which keeps five markers per sample instead of all values of a window. Use it
+for windows with millions of lines.
+
+Chromosomes can be processed in parallel with -T (number of processes). The lines of every chromosome must be contiguous in the input file.
+
 #contact:
 
 Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
@@ -57,8 +63,12 @@ Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
 
 ############################# modules #############################
 
+import bgzf  # compressed input and output
 import calls  # my custom module
-from numpy import median
+import StringIO
+import numpy as np
+import tabindex  # index of tables, region queries and parallel processing
+import windows  # sliding window engine
 
 ############################# options #############################
 
@@ -69,115 +79,142 @@ parser.add_argument(
     '-o', '--output', help='name of the output file', type=str, required=True)
 parser.add_argument(
     '-w', '--window', help='sliding window size', type=int, required=True)
+parser.add_argument(
+    '-a', '--approximate', help='estimate medians with constant memory per window',
+    action='store_true', required=False)
+parser.add_argument(
+    '-T', '--threads', help='number of processes to process chromosomes in parallel',
+    type=int, required=False, default=1)
+parser.add_argument(
+    '-r', '--region', help='region to process, chr:start-end (optional)',
+    type=str, required=False)
 args = parser.parse_args()
 
 ############################# functions #############################
 
-def meanWindow(dictList):
-    ''' calculates median of a window'''
-    for k in dictList:
-        values = []
-        for val in dictList[k]:
-            if val != 'NA':
-                values.append(float(val))
-        if len(values) > 0:
-            medianValue = median(values)
-            dictList[k] = medianValue
+class MedianEstimate(object):
+    ''' estimates a median with the P-square algorithm (Jain and Chlamtac
+    1985), which keeps five markers instead of all values'''
+
+    def __init__(self):
+        self.q = []  # heights of the markers, the first five values
+        self.n = [0, 1, 2, 3, 4]  # positions of the markers
+        self.count = 0
+
+    def update(self, values):
+        q = self.q
+        n = self.n
+        count = self.count
+        for x in values:
+            count += 1
+            if count <= 5:
+                q.append(x)
+                if count == 5:
+                    q.sort()
+                continue
+            # find the cell of the value
+            if x < q[0]:
+                q[0] = x
+                k = 0
+            elif x >= q[4]:
+                q[4] = x
+                k = 3
+            else:
+                k = 0
+                while x >= q[k+1]:
+                    k += 1
+            for j in xrange(k+1, 5):
+                n[j] += 1
+            # adjust the middle markers to their desired positions
+            for i in (1, 2, 3):
+                d = (count-1)*i/4.0 - n[i]
+                if (d >= 1 and n[i+1]-n[i] > 1) or (d <= -1 and n[i-1]-n[i] < -1):
+                    d = 1 if d > 0 else -1
+                    qp = q[i] + float(d)/(n[i+1]-n[i-1])*(
+                        (n[i]-n[i-1]+d)*(q[i+1]-q[i])/(n[i+1]-n[i]) +
+                        (n[i+1]-n[i]-d)*(q[i]-q[i-1])/(n[i]-n[i-1]))
+                    if not q[i-1] < qp < q[i+1]:
+                        qp = q[i] + d*(q[i+d]-q[i])/(n[i+d]-n[i])
+                    q[i] = qp
+                    n[i] += d
+        self.count = count
+
+    def median(self):
+        if self.count >= 5:
+            return self.q[2]
+        elif self.count > 0:
+            return np.median(self.q)
+        return np.nan
+
+class ApproximateMedians(object):
+    ''' estimates the median of every sample of a window with constant
+    memory'''
+
+    def __init__(self):
+        self.estimates = [MedianEstimate() for s in sampleNames]
+
+    def add(self, values):
+        for s, estimate in enumerate(self.estimates):
+            column = values[:, s]
+            estimate.update(column[~np.isnan(column)].tolist())
+
+    def medians(self):
+        return np.array([e.median() for e in self.estimates])
+
+def printWindow(medians):
+    ''' creates print string from the medians of a window'''
+    return '\t'.join('NA' if m != m else str(m) for m in medians)
+
+def processLines(lines, outputFile, resumed=False):
+    ''' calculates median values per window for the lines of the input file,
+    resumed is True if the lines start after a chromosome change'''
+    blocks = windows.readValueBlocks(lines, len(header_words), missing=('NA',))
+    if args.approximate:
+        newWindow = ApproximateMedians
+    else:
+        newWindow = windows.WindowValues
+    for Chr, posS, posE, window in windows.slideWindows(blocks, windSize,
+                                                        newWindow, resumed):
+        if window is None:
+            medianWindowP = '\t'.join('NA' for s in sampleNames)
+        elif args.approximate:
+            medianWindowP = printWindow(window.medians())
         else:
-            dictList[k] = 'NA'
-    return dictList
-
-def createNewDict(NamesList):
-    ''' creates a new empty dictionary with sample names as keys'''
-    newDict = {}
-    for k in NamesList:
-        newDict[k] = []
-    return newDict
-
-def printWindow(inputDict, orderedNames):
-    ''' creates print string from a dictionary with mean values'''
-    newList = []
-    for n in orderedNames:
-        newList.append(inputDict[n])
-    newListP = '\t'.join(str(el) for el in newList)
-    return newListP
+            medianWindowP = printWindow(windows.windowMedian(window))
+        calls.processWindow(Chr, posS, posE, medianWindowP, outputFile)
+
+
+def processShard(fileName, start, end, resumed):
+    ''' calculates median values per window for one chromosome of the input file'''
+    output = StringIO.StringIO()
+    processLines(tabindex.readRange(fileName, start, end), output, resumed)
+    return output.getvalue()
+
 
 ############################# program #############################
 
 print('Opening the file...')
 
 windSize = args.window
-windPosEnd = windSize
-counter = 0
 
-with open(args.input) as datafile:
+with tabindex.openTable(args.input, args.region) as datafile:
     header_line = datafile.readline()
 
     # make output header
-    outputFile = open(args.output, 'w')
+    outputFile = bgzf.openFile(args.output, 'w')
     outputFile.write(header_line)
 
     # make samples dict
     header_words = header_line.split()
     sampleNames = header_words[2:]
-    windowDict = createNewDict(sampleNames)
 
     print('Processing the data  ...')
 
-    ChrPrevious = ''
-    posS = ''
-    posE = ''
-    for line in datafile:
-        words = line.split()
-        Chr = words[0]
-        pos = int(words[1])
-        indVal = words[2:]
-
-        # to store the values of a previous line
-        if not ChrPrevious:
-            ChrPrevious = Chr
-        if not posS:
-            posS = windPosEnd - windSize
-        if not posE:
-            posE = windPosEnd
-
-        # if window size is reached output the results
-        if Chr != ChrPrevious:  # if end of a chromosome
-            meanValWindow = meanWindow(windowDict)
-            meanValWindowP = printWindow(meanValWindow, sampleNames)
-            calls.processWindow(ChrPrevious, posS, posE,
-                                meanValWindowP, outputFile)
-            windPosEnd = windSize
-            windowDict = createNewDict(sampleNames)
-            posS = windPosEnd - windSize
-        elif pos > windPosEnd:  # if end of a window
-            meanValWindow = meanWindow(windowDict)
-            meanValWindowP = printWindow(meanValWindow, sampleNames)
-            calls.processWindow(Chr, posS, posE,
-                                meanValWindowP, outputFile)
-            windPosEnd = windPosEnd + windSize
-            windowDict = createNewDict(sampleNames)
-            posS = windPosEnd - windSize
-            while pos > windPosEnd:  # gap is larger than window size
-                windPosEnd = windPosEnd + windSize
-
-        ChrPrevious = Chr
-        posE = windPosEnd
-
-        # append values
-        for s in xrange(len(sampleNames)):
-            windowDict[sampleNames[s]].append(indVal[s])
-
-        # track progress
-        counter += 1
-        if counter % 1000000 == 0:
-            print str(counter), "lines processed"
-
-# process the last window
-meanValWindow = meanWindow(windowDict)
-meanValWindowP = printWindow(meanValWindow, sampleNames)
-calls.processWindow(Chr, posS, windPosEnd,
-                    meanValWindowP, outputFile)
+    if args.threads > 1 and not args.region:
+        for text in tabindex.runSharded(args.input, processShard, args.threads):
+            outputFile.write(text)
+    else:
+        processLines(datafile, outputFile)
 
 datafile.close()
 outputFile.close()
@@ -49,6 +49,22 @@ test.tab    0.1125
 
 $ python calculate_Total-Hetero.py -i input.tab -o output.tab -s "sample1,sample2,sample3,sample4,sample5,sample6,sample7,sample8"
 
+The heterozygosity is the mean over the sites of the proportion of heterozygous genotypes among the called ones.
+It is accumulated block by block with compensated summation, so memory does not depend on the number of sites.
+With -V (--variance) the variance of the proportions is written after the mean and with -b (--block) the standard
+error of the mean estimated with the weighted block jackknife over blocks of the given size (bp):
+
+$ python calculate_Total-Hetero.py -i input.tab -o output.tab -V -b 2 -s "sample1,sample2,sample3,sample4,sample5,sample6,sample7,sample8"
+
+test.tab    0.1125  0.0327840909091  0.0642703805666
+
+With --per-sample the heterozygosity of every sample (heterozygous / called genotypes) is written instead, one sample per line:
+
+sample  Heter [var] [SE]
+sample1 0.2727
+sample2 0.1111
+...
+
 #contact:
 
 Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
@@ -57,8 +73,12 @@ Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
 
 ############################# modules #############################
 
+import bgzf # compressed input and output
 import calls # my custom module
+import estimators # constant memory accumulators and block jackknife
+import genotypes # block reader of calls tables
 import numpy as np
+import tabindex # index of tables and region queries
 
 ############################# options #############################
 
@@ -66,11 +86,15 @@ parser = calls.CommandLineParser()
 parser.add_argument('-i', '--input', help = 'name of the input file', type=str, required=True)
 parser.add_argument('-o', '--output', help = 'name of the output file', type=str, required=True)
 parser.add_argument('-s', '--samples', help = 'column names of the samples to process (optional)', type=str, required=False)
+parser.add_argument('-V', '--variance', help = 'write also the variance', action='store_true', required=False)
+parser.add_argument('-b', '--block', help = 'size of blocks (bp) to estimate the standard error with the block jackknife (optional)', type=int, required=False)
+parser.add_argument('--per-sample', help = 'heterozygosity of every sample instead of all samples together', action='store_true', required=False)
+parser.add_argument('-r', '--region', help = 'region to process, chr:start-end (optional)', type=str, required=False)
 args = parser.parse_args()
 
 
 # check if samples names are given and if all sample names are present in a header
-sampleNames = calls.checkSampleNames(args.samples, args.input)
+sampleNames = tabindex.checkSampleNames(args.samples, args.input)
 
 ############################# functions #############################
 
@@ -81,7 +105,7 @@ print('Opening the file...')
 
 counter = 0
 
-with open(args.input) as datafile:
+with tabindex.openTable(args.input, args.region) as datafile:
   header_line = datafile.readline()
   header_words = header_line.split()
 
@@ -93,34 +117,74 @@ with open(args.input) as datafile:
 ############################## perform counting ####################
 
   print('Counting heterozygots ...')
-  Hcount = []
-
-  for line in datafile:
-    words = line.split()
-
-    # select samples
-    sample_charaters = calls.selectSamples(sampCol, words)
-
-    # check if one- or two-character code
-    if any(["/" in gt for gt in sample_charaters]):
-      sample_charaters = calls.twoToOne(sample_charaters)
-
-    # count hetero
-    Nmising = calls.countPerPosition(sample_charaters, 'N')
-    nHeter = calls.countHeteroPerPosition(sample_charaters)
-    nTotal = float(nSample - Nmising)
-    if nTotal != 0:
-      Hcount.append(float(nHeter/nTotal))
+  heteroTotal = estimators.MeanVariance()
+  if args.block:
+    # sums of heterozygosity and numbers of sites or of called genotypes per block
+    if args.per_sample:
+      jackknifeBlocks = estimators.BlockSums(args.block, 2*nSample)
+    else:
+      jackknifeBlocks = estimators.BlockSums(args.block, 2)
+  heteroSample = np.zeros(nSample, dtype=np.int64)
+  calledSample = np.zeros(nSample, dtype=np.int64)
+
+  for Chrs, positions, sample_charaters in genotypes.readBlocks(datafile, sampCol, len(header_words)):
+
+    if args.per_sample:
+      # count hetero per sample
+      heteroSites = genotypes.isHetero(sample_charaters)
+      calledSites = genotypes.isCalled(sample_charaters)
+      heteroSample += heteroSites.sum(axis=0)
+      calledSample += calledSites.sum(axis=0)
+      if args.block:
+        jackknifeBlocks.add(Chrs, positions, np.hstack([heteroSites, calledSites]))
+    else:
+      # count hetero
+      Nmising = genotypes.countPerSite(sample_charaters, 'N')
+      nHeter = genotypes.countHeteroPerSite(sample_charaters)
+      nTotal = (nSample - Nmising).astype(float)
+      called = nTotal != 0
+      Hsites = nHeter[called]/nTotal[called]
+      heteroTotal.add(Hsites)
+      if args.block:
+        jackknifeBlocks.add(Chrs[called], positions[called], np.column_stack([Hsites, np.ones(len(Hsites))]))
 
     # track progress
-    counter += 1
-    if counter % 1000000 == 0:
+    counter += len(positions)
+    if counter % 1000000 < len(positions):
       print str(counter), "lines processed"
 
+# standard errors
+if args.block:
+  blockSums = jackknifeBlocks.sums()
+  heteroSE = estimators.ratioJackknife(*np.split(blockSums, 2, axis=1))[1].ravel().tolist()
+
 # make output header
-outputFile = open(args.output, 'w')
-heteroT = round(np.mean(Hcount), 4)
-outputFile.write("%s\t%s\n" % (args.input, heteroT))
+outputFile = bgzf.openFile(args.output, 'w')
+if args.per_sample:
+  header = ['sample', 'Heter']
+  if args.variance:
+    header.append('var')
+  if args.block:
+    header.append('SE')
+  outputFile.write("%s\n" % '\t'.join(header))
+  for i, (hetero, called) in enumerate(zip(heteroSample.tolist(), calledSample.tolist())):
+    if called:
+      values = [round(float(hetero)/called, 4)]
+    else:
+      values = ['NA']
+    if args.variance:
+      # variance of heterozygous (1) and homozygous (0) genotypes
+      values.append((hetero - float(hetero)**2/called)/(called - 1) if called > 1 else float("nan"))
+    if args.block:
+      values.append(heteroSE[i])
+    outputFile.write("%s\t%s\n" % (sampleNames[i], '\t'.join('NA' if v != v else str(v) for v in values)))
+else:
+  values = [round(heteroTotal.mean(), 4)]
+  if args.variance:
+    values.append(float(heteroTotal.variance()))
+  if args.block:
+    values.append(heteroSE[0])
+  outputFile.write("%s\t%s\n" % (args.input, '\t'.join('NA' if v != v else str(v) for v in values)))
 
 datafile.close()
 outputFile.close()
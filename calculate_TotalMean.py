@@ -34,9 +34,11 @@ Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
 
 ############################# modules #############################
 
+import bgzf # compressed input and output
 import calls # my custom module
 import numpy as np
 import warnings
+import tabindex # index of tables and region queries
 
 ############################# options #############################
 
@@ -44,11 +46,12 @@ parser = calls.CommandLineParser()
 parser.add_argument('-i', '--input', help = 'name of the input file', type=str, required=True)
 parser.add_argument('-o', '--output', help = 'name of the output file', type=str, required=True)
 parser.add_argument('-s', '--samples', help = 'column names of the samples to process (optional)', type=str, required=False)
+parser.add_argument('-r', '--region', help = 'region to process, chr:start-end (optional)', type=str, required=False)
 args = parser.parse_args()
 
 
 # check if samples names are given and if all sample names are present in a header
-sampleNames = calls.checkSampleNames(args.samples, args.input)
+sampleNames = tabindex.checkSampleNames(args.samples, args.input)
 
 ############################# functions #############################
 
@@ -59,7 +62,7 @@ print('Opening the file...')
 
 counter = 0
 
-with open(args.input) as datafile:
+with tabindex.openTable(args.input, args.region) as datafile:
   header_line = datafile.readline()
   header_words = header_line.split()
 
@@ -96,7 +99,7 @@ with open(args.input) as datafile:
       print str(counter), "lines processed"
 
 # make output header
-outputFile = open(args.output, 'w')
+outputFile = bgzf.openFile(args.output, 'w')
 heteroT = round(sumT/sumN, 2)
 outputFile.write("%s\t%s\n" % (args.input, heteroT))
 
@@ -45,6 +45,15 @@ $ python calculate_WindowAverage_perSNP.py \
     -o output.tab \
     -w 50000
 
+With -S (--stream) only the SNPs within the windows of the SNPs that are
+not written yet are kept in memory. Window averages are written as soon as
+a position beyond the right edge of their window is read, so memory depends
+on the SNP density and the window size instead of the chromosome length.
+
+The window sums are exact to about 19 digits, so a mean that falls halfway
+between two printed values may differ in the last digit from a plain
+left-to-right sum, or between runs with and without -S.
+
 #contact:
 
 Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
@@ -53,8 +62,11 @@ Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
 
 ############################# modules #############################
 
+import bgzf  # compressed input and output
 import calls  # my custom module
-import bisect
+import genotypes  # block reader of tables
+import numpy as np
+import tabindex  # index of tables and region queries
 
 ############################# options #############################
 
@@ -68,33 +80,107 @@ parser.add_argument(
 parser.add_argument(
     '-m', '--min', help='minimum number of SNPs to keep window',
     type=int, required=False, default=1)
+parser.add_argument(
+    '-S', '--stream', help='keep only the SNPs of the current windows in memory',
+    action='store_true', required=False)
+parser.add_argument(
+    '-r', '--region', help='region to process, chr:start-end (optional)',
+    type=str, required=False)
 args = parser.parse_args()
 
 ############################# functions #############################
 
-def average(lst, minNumberSNPs):
-    if len(lst) >= minNumberSNPs:
-        avg = sum(lst)/len(lst)
-    else:
-        avg = 'NA'
-    return avg
-
-def slideWindow():
-    for i in posList:
-        # if start of chromosome
-        if i <= windSize:
-            startIndex = 0
-        else:
-            windStart = i-windSize
-            startIndex = bisect.bisect(posList, windStart)
-        windowEnd = i+windSize
-        endIndex = bisect.bisect(posList, windowEnd)
-
-        outputFile.write("%s\t%s" % (ChrPrevious, i))
-        for n in statName:
-            windowAverage = average(statsDic[n][startIndex:endIndex], minSNPs)
-            outputFile.write("\t%s" % windowAverage)
-        outputFile.write("\n")
+def parseStats(tokens):
+    ''' converts an array of statistics tokens to floats, NA to NaN'''
+    return np.where(tokens == 'NA', 'nan', tokens).astype(np.float64)
+
+def windowBounds(positions, centres, windSize):
+    ''' returns the start and end indices in positions of the windows
+    centred at each of centres'''
+    starts = np.searchsorted(positions, centres - windSize, side='right')
+    # if start of chromosome
+    starts[centres <= windSize] = 0
+    ends = np.searchsorted(positions, centres + windSize, side='right')
+    return starts, ends
+
+def rebasedSums(values, starts, ends, minChunk=1024):
+    ''' returns the sums of values[starts[i]:ends[i]] (starts and ends do not
+    decrease) as differences of cumulative sums. The cumulative sums restart
+    for every chunk of windows whose starts are less than the largest window
+    (in values) apart, so they stay of the magnitude of the values around the windows and
+    large values elsewhere on the chromosome do not cost precision'''
+    sums = np.zeros((len(starts), values.shape[1]))
+    if len(starts) == 0:
+        return sums
+    chunk = max(int((ends - starts).max()), minChunk)
+    first = 0
+    while first < len(starts):
+        base = starts[first]
+        last = np.searchsorted(starts, base + chunk, side='left')
+        stop = ends[first:last].max()
+        local = np.zeros((stop - base + 1, values.shape[1]), dtype=np.longdouble)
+        np.cumsum(values[base:stop], axis=0, dtype=np.longdouble, out=local[1:])
+        sums[first:last] = local[ends[first:last] - base] - local[starts[first:last] - base]
+        first = last
+    return sums
+
+def windowAverages(stats, starts, ends, minNumberSNPs):
+    ''' calculates window means of every statistic from the sums of the
+    finite values (see rebasedSums) and counts of the values that are not
+    NaN. Inf and -Inf are counted separately, so they only change the means
+    of the windows that contain them. NaN is returned for windows with fewer
+    than minNumberSNPs values'''
+    finite = np.isfinite(stats)
+
+    def windowCounts(mask):
+        counts = np.zeros((len(stats)+1, stats.shape[1]), dtype=np.int64)
+        np.cumsum(mask, axis=0, out=counts[1:])
+        return counts[ends] - counts[starts]
+
+    positiveInf = windowCounts(stats == np.inf)
+    negativeInf = windowCounts(stats == -np.inf)
+    numberSNPs = windowCounts(finite) + positiveInf + negativeInf
+    windowSums = rebasedSums(np.where(finite, stats, 0), starts, ends)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        averages = windowSums / numberSNPs
+    averages[positiveInf > 0] = np.inf
+    averages[negativeInf > 0] = -np.inf
+    averages[(positiveInf > 0) & (negativeInf > 0)] = np.nan
+    averages[(numberSNPs < minNumberSNPs) | (numberSNPs == 0)] = np.nan
+    return averages
+
+def slideWindow(Chr, positions, stats, first=0, last=None):
+    ''' writes the window averages of the SNPs first to last of a chromosome
+    (all SNPs by default)'''
+    centres = positions[first:last]
+    starts, ends = windowBounds(positions, centres, windSize)
+    averages = windowAverages(stats, starts, ends, minSNPs)
+    outLines = []
+    for pos, values in zip(centres.tolist(), averages.tolist()):
+        outLines.append("%s\t%s" % (Chr, pos))
+        for windowAverage in values:
+            if windowAverage != windowAverage:
+                windowAverage = 'NA'
+            outLines.append("\t%s" % windowAverage)
+        outLines.append("\n")
+    outputFile.write(''.join(outLines))
+
+def streamWindows(Chr, positions, stats, pending):
+    ''' writes the SNPs of a chromosome buffer, starting from pending, whose
+    windows are complete and drops the SNPs that are not in the windows of
+    the remaining SNPs. Returns the buffer and the new index of pending'''
+    # a position beyond the right edge of the window has been read
+    ready = np.searchsorted(positions, positions[-1] - windSize, side='left')
+    if ready > pending:
+        slideWindow(Chr, positions, stats, pending, ready)
+        pending = ready
+    # the next SNPs start their windows after this position
+    nextPos = positions[min(pending, len(positions)-1)]
+    drop = 0
+    if nextPos > windSize:
+        drop = min(np.searchsorted(positions, nextPos - windSize,
+                                   side='right'), pending)
+    return [positions[drop:]], [stats[drop:]], pending - drop
 
 ############################# program #############################
 
@@ -104,52 +190,55 @@ windSize = args.window/2
 counter = 0
 minSNPs = args.min 
 
-with open(args.input) as datafile:
+with tabindex.openTable(args.input, args.region) as datafile:
     header_line = datafile.readline()
     statName = header_line.split()[2:]
 
     # make output header
-    outputFile = open(args.output, 'w')
+    outputFile = bgzf.openFile(args.output, 'w')
     outputFile.write(header_line)
 
     print('Processing the data  ...')
 
+    # blocks of the current chromosome, pending is the first SNP
+    # that is not written yet
     ChrPrevious = ''
-    posStart = ''
-    posEnd = ''
-    for line in datafile:
-        words = line.split()
-        Chr = words[0]
-        pos = int(float(words[1]))
-        stats = [float(i) for i in words[2:]]
-        
-        # read in one chromosome
-        if ChrPrevious == '':
-            posList = []
-            statsDic = {key: [] for key in statName}
-            posList.append(pos)
-            for n in statName:
-                statsDic[n].append(stats[statName.index(n)])
-        elif Chr == ChrPrevious:
-            posList.append(pos)
-            for n in statName:
-                statsDic[n].append(stats[statName.index(n)])
-        else:
-            slideWindow()
-            posList = []
-            statsDic = {key: [] for key in statName}
-            posList.append(pos)
-            for n in statName:
-                statsDic[n].append(stats[statName.index(n)])
-           
-        ChrPrevious = Chr
+    posBlocks = []
+    statsBlocks = []
+    pending = 0
+    for tokens in genotypes.readTokenBlocks(datafile, len(statName)+2):
+        chroms = tokens[:, 0]
+        positions = tokens[:, 1].astype(np.float64).astype(np.int64)
+        stats = parseStats(tokens[:, 2:])
+
+        # split the block at chromosome boundaries
+        bounds = np.flatnonzero(chroms[1:] != chroms[:-1]) + 1
+        for s, e in zip(np.r_[0, bounds], np.r_[bounds, len(chroms)]):
+            Chr = chroms[s]
+            if Chr != ChrPrevious and posBlocks:
+                slideWindow(ChrPrevious, np.concatenate(posBlocks),
+                            np.concatenate(statsBlocks), pending)
+                posBlocks = []
+                statsBlocks = []
+                pending = 0
+            posBlocks.append(positions[s:e])
+            statsBlocks.append(stats[s:e])
+            ChrPrevious = Chr
+
+        if args.stream:
+            posBlocks, statsBlocks, pending = streamWindows(
+                ChrPrevious, np.concatenate(posBlocks),
+                np.concatenate(statsBlocks), pending)
+
         # track progress
-        counter += 1
-        if counter % 1000000 == 0:
+        counter += len(tokens)
+        if counter // 1000000 != (counter - len(tokens)) // 1000000:
             print str(counter), "lines processed"
 
     # process the last chromosome
-    slideWindow()
+    if posBlocks:
+        slideWindow(ChrPrevious, np.concatenate(posBlocks),
+                    np.concatenate(statsBlocks), pending)
 
 datafile.close()
 outputFile.close()
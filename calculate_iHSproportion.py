@@ -58,6 +58,12 @@ $ python calculate_iHSproportion.py \
     -w 1000 \
     -t 2
 
+With --step the windows overlap: a window of size -w starts every step bp, (k*step, k*step+w]. Windows without sites are skipped.
+
+With --sites N the windows have N SNPs with iHS values instead of a size in bp. The first and the last positions of every window are written after POS, the last window of a chromosome can have fewer SNPs.
+
+Chromosomes can be processed in parallel with -T (number of processes). The lines of every chromosome must be contiguous in the input file.
+
 #contact:
 
 Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
@@ -66,7 +72,12 @@ Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
 
 ############################# modules #############################
 
+import bgzf  # compressed input and output
 import calls  # my custom module
+import numpy as np
+import StringIO
+import tabindex  # index of tables, region queries and parallel processing
+import windows  # sliding window engine
 
 ############################# options #############################
 
@@ -87,13 +98,33 @@ parser.add_argument(
     '--window',
     help='sliding window size',
     type=int,
-    required=True)
+    required=False)
 parser.add_argument(
     '-t',
     '--threshold',
     help='iHS threshold to calculate propotion for',
     type=int,
     required=True)
+parser.add_argument(
+    '--sites',
+    help='number of informative sites per window, instead of -w',
+    type=int,
+    required=False)
+parser.add_argument(
+    '--step',
+    help='step of overlapping windows (optional)',
+    type=int,
+    required=False)
+parser.add_argument(
+    '-T',
+    '--threads',
+    help='number of processes to process chromosomes in parallel',
+    type=int,
+    required=False,
+    default=1)
+parser.add_argument(
+    '-r', '--region', help='region to process, chr:start-end (optional)',
+    type=str, required=False)
 args = parser.parse_args()
 
 ############################# functions #############################
@@ -101,89 +132,88 @@ args = parser.parse_args()
 
 def proportionWindow(values, threshold):
     ''' calculates proportion of a values larger than threshold'''
-    largerThan = []
-    for i in values:
-        if abs(i) >= threshold:
-            largerThan.append(i)
-    windowSize = len(values)
-    proportion = len(largerThan) / float(windowSize)
+    windowSize = int(windows.windowCount(values)[0])
+    proportion = float(windows.proportionAbove(values, threshold, True)[0])
     return [windowSize, proportion]
 
 
+def largeValues(blocks, threshold):
+    ''' converts blocks of values to 1 if the absolute value is equal to or
+    larger than threshold and 0 otherwise, NaN stays NaN'''
+    for chroms, positions, values in blocks:
+        with np.errstate(invalid='ignore'):
+            large = (np.abs(values) >= threshold).astype(np.float64)
+        large[np.isnan(values)] = np.nan
+        yield chroms, positions, large
+
+
+def processLines(lines, outputFile, resumed=False):
+    ''' calculates proportions of large iHS values per window for the lines
+    of the input file, resumed is True if the lines start after a chromosome
+    change'''
+    blocks = windows.readValueBlocks(lines, 3, missing=('NA',))
+    if args.sites:
+        for Chr, posS, posE, window in windows.slideSites(
+                largeValues(blocks, args.threshold), args.sites):
+            meanValWindow = [posS, posE, int(window.counts[0]),
+                             float(window.mean()[0])]
+            meanValWindowP = '\t'.join(str(s) for s in meanValWindow)
+            calls.processWindow(Chr, posS, posE, meanValWindowP, outputFile)
+        return
+    if args.step:
+        for Chr, posS, posE, window in windows.slideSteps(
+                largeValues(blocks, args.threshold), windSize, args.step,
+                siteBounds=True):
+            meanValWindow = [int(window.counts[0]), float(window.mean()[0])]
+            meanValWindowP = '\t'.join(str(s) for s in meanValWindow)
+            calls.processWindow(Chr, posS, posE, meanValWindowP, outputFile)
+        return
+    for Chr, posS, posE, values in windows.slideWindows(
+            blocks, windSize, resumed=resumed, siteBounds=True):
+        if values is None:
+            continue
+        meanValWindow = proportionWindow(values, args.threshold)
+        meanValWindowP = '\t'.join('NA' if s != s else str(s)
+                                   for s in meanValWindow)
+        calls.processWindow(Chr, posS, posE, meanValWindowP, outputFile)
+
+
+def processShard(fileName, start, end, resumed):
+    ''' calculates proportions of large iHS values per window for one
+    chromosome of the input file'''
+    output = StringIO.StringIO()
+    processLines(tabindex.readRange(fileName, start, end), output, resumed)
+    return output.getvalue()
+
+
 ############################# program #############################
 
 print('Opening the file...')
 
 windSize = args.window
-windPosEnd = windSize
-counter = 0
+if not windSize and not args.sites:
+    raise IOError('Window size (-w) or number of sites (--sites) is required')
 
-with open(args.input) as datafile:
+with tabindex.openTable(args.input, args.region) as datafile:
     header_line = datafile.readline()
 
     # make output header
     header_words = header_line.split()
     chrPos = header_words[0:2]
+    if args.sites:
+        # windows of sites report their first and last positions
+        chrPos += ['start', 'end']
     chrPosP = '\t'.join(str(s) for s in chrPos)
-    outputFile = open(args.output, 'w')
+    outputFile = bgzf.openFile(args.output, 'w')
     outputFile.write("%s\tnSNPs\t%s\n" % (chrPosP, header_words[2]))
 
     print('Processing the data  ...')
 
-    Vwindow = []
-    ChrPrevious = ''
-    posS = ''
-    posE = ''
-    for line in datafile:
-        words = line.split()
-        Chr = words[0]
-        pos = int(words[1])
-        indVal = float(words[2])
-
-        # to store the values of a previous line
-        if not ChrPrevious:
-            ChrPrevious = Chr
-        if not posS:
-            posS = pos
-        if not posE:
-            posE = pos
-
-        # if window size is reached output the results
-        if Chr != ChrPrevious:  # if end of a chromosome
-            meanValWindow = proportionWindow(Vwindow, args.threshold)
-            meanValWindowP = '\t'.join(str(s) for s in meanValWindow)
-            calls.processWindow(ChrPrevious, posS, posE,
-                                meanValWindowP, outputFile)
-            windPosEnd = windSize
-            Vwindow = []
-            posS = pos
-        elif pos > windPosEnd:  # if end of a window
-            if Vwindow:
-                meanValWindow = proportionWindow(Vwindow, args.threshold)
-                meanValWindowP = '\t'.join(str(s) for s in meanValWindow)
-                calls.processWindow(Chr, posS, posE,
-                                    meanValWindowP, outputFile)
-            windPosEnd = windPosEnd + windSize
-            Vwindow = []
-            posS = pos
-            while pos > windPosEnd:  # gap is larger than window size
-                windPosEnd = windPosEnd + windSize
-
-        ChrPrevious = Chr
-        posE = pos
-
-        # append values
-        Vwindow.append(indVal)
-
-        # track progress
-        counter += 1
-        if counter % 1000000 == 0:
-            print str(counter), "lines processed"
-
-# process the last window
-meanValWindow = proportionWindow(Vwindow, args.threshold)
-meanValWindowP = '\t'.join(str(s) for s in meanValWindow)
-calls.processWindow(Chr, posS, pos, meanValWindowP, outputFile)
+    if args.threads > 1 and not args.region:
+        for text in tabindex.runSharded(args.input, processShard, args.threads):
+            outputFile.write(text)
+    else:
+        processLines(datafile, outputFile)
 
 datafile.close()
 outputFile.close()
@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+'''
+Accumulators of genome-wide statistics with constant memory and the
+weighted block jackknife.
+
+Values are added block by block (the blocks of the block reader): the sum of
+a block is calculated by NumPy and the sums of the blocks are added with
+compensated (Neumaier) summation, so the precision does not decrease with
+the number of sites. The variance is merged from the means and the sums of
+squared deviations of the blocks (Chan et al. 1979).
+
+For the block jackknife the sums of a statistic are kept per genomic block
+(a chromosome is split in blocks of a given size in bp), which needs memory
+for the blocks but not for the sites. A ratio of the sums, such as the mean
+or the D statistic, and its standard error are then estimated with the
+weighted block jackknife of Busing et al. (1999), or from the estimates
+without each of the blocks with equally weighted blocks (blockJackknife).
+
+#Example:
+
+import estimators
+
+meanVariance = estimators.MeanVariance()
+jackknifeBlocks = estimators.BlockSums(5000000, 2)
+for Chrs, positions, values in readValues(datafile):
+    meanVariance.add(values)
+    jackknifeBlocks.add(Chrs, positions,
+                        np.column_stack([values, np.ones(len(values))]))
+sums = jackknifeBlocks.sums()
+mean, se = estimators.ratioJackknife(sums[:, 0], sums[:, 1])
+
+#contact:
+
+Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
+
+'''
+
+############################# modules #############################
+
+import numpy as np
+
+############################# functions #############################
+
+class CompensatedSum(object):
+    ''' sum of floats with Neumaier compensation of the rounding errors'''
+
+    def __init__(self):
+        self.total = 0.0
+        self.compensation = 0.0
+
+    def add(self, value):
+        value = float(value)
+        total = self.total + value
+        if abs(self.total) >= abs(value):
+            self.compensation += (self.total - total) + value
+        else:
+            self.compensation += (value - total) + self.total
+        self.total = total
+
+    def value(self):
+        return self.total + self.compensation
+
+
+class MeanVariance(object):
+    ''' number of values, mean and variance of all added values'''
+
+    def __init__(self):
+        self.n = 0
+        self.total = CompensatedSum()
+        self.m2 = 0.0 # sum of squared deviations from the mean
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return
+        blockMean = values.mean()
+        blockM2 = np.square(values - blockMean).sum()
+        if self.n:
+            delta = blockMean - self.mean()
+            self.m2 += blockM2 + delta * delta * self.n * n / (self.n + n)
+        else:
+            self.m2 = blockM2
+        self.n += n
+        self.total.add(values.sum())
+
+    def mean(self):
+        if self.n == 0:
+            return np.nan
+        return self.total.value() / self.n
+
+    def variance(self):
+        ''' variance with N-1 in the denominator'''
+        if self.n < 2:
+            return np.nan
+        return self.m2 / (self.n - 1)
+
+
+class BlockSums(object):
+    ''' sums of columns of values per genomic block of blockSize bp,
+    blocks do not span chromosomes'''
+
+    def __init__(self, blockSize, nColumns):
+        self.blockSize = blockSize
+        self.nColumns = nColumns
+        self.blocks = [] # sums of the finished blocks
+        self.key = None # chromosome and number of the open block
+        self.open = np.zeros(nColumns)
+
+    def _segments(self, chroms, positions):
+        ''' returns the keys (chromosome and block number) and the start
+        indices of the runs of sites of the same block'''
+        numbers = (positions - 1) // self.blockSize
+        changes = np.flatnonzero((chroms[1:] != chroms[:-1]) |
+                                 (numbers[1:] != numbers[:-1])) + 1
+        starts = np.r_[0, changes]
+        keys = zip(chroms[starts].tolist(), numbers[starts].tolist())
+        return keys, starts
+
+    def _addSum(self, key, blockSum):
+        if key != self.key:
+            if self.key is not None:
+                self.blocks.append(self.open)
+            self.key = key
+            self.open = np.zeros(self.nColumns)
+        self.open = self.open + blockSum
+
+    def add(self, chroms, positions, values):
+        if len(positions) == 0:
+            return
+        values = np.asarray(values, dtype=np.float64).reshape(len(positions), -1)
+        keys, starts = self._segments(chroms, positions)
+        for key, blockSum in zip(keys, np.add.reduceat(values, starts, axis=0)):
+            self._addSum(key, blockSum)
+
+    def addSums(self, chroms, positions, sumSites):
+        ''' adds sums of sites calculated by sumSites(start, end) for every
+        run of sites start:end of the same block'''
+        if len(positions) == 0:
+            return
+        keys, starts = self._segments(chroms, positions)
+        ends = np.r_[starts[1:], len(positions)]
+        for key, start, end in zip(keys, starts.tolist(), ends.tolist()):
+            self._addSum(key, sumSites(start, end))
+
+    def sums(self):
+        ''' returns a matrix (blocks x columns) of the sums'''
+        blocks = self.blocks
+        if self.key is not None:
+            blocks = blocks + [self.open]
+        return np.array(blocks).reshape(len(blocks), self.nColumns)
+
+
+def ratioJackknife(numerators, denominators):
+    ''' estimates the ratio of the sums of numerators and denominators
+    (arrays of blocks, or blocks x statistics) and its standard error with
+    the weighted block jackknife, the blocks are weighted by their
+    denominators. Returns the estimates and the standard errors'''
+    numerators = np.asarray(numerators, dtype=np.float64)
+    denominators = np.asarray(denominators, dtype=np.float64)
+    totalNum = numerators.sum(axis=0)
+    totalDen = denominators.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        estimate = totalNum / totalDen
+        # estimates without one block
+        partial = (totalNum - numerators) / (totalDen - denominators)
+        h = totalDen / denominators
+        used = (denominators != 0) & (h != 1)
+        g = used.sum(axis=0)
+        weights = np.where(used, 1 - 1 / h, 0)
+        partial = np.where(used, partial, 0)
+        jackknife = g * estimate - (weights * partial).sum(axis=0)
+        pseudo = h * estimate - (h - 1) * partial
+        deviations = np.where(used, np.square(pseudo - jackknife) / (h - 1), 0)
+        variance = deviations.sum(axis=0) / g
+    se = np.where(g > 1, np.sqrt(variance), np.nan)
+    return estimate, se
+
+
+def blockJackknife(estimate, partial):
+    ''' standard error of an estimate from its delete-one-block estimates
+    (blocks, or blocks x statistics) with equally weighted blocks'''
+    partial = np.asarray(partial, dtype=np.float64)
+    nBlocks = len(partial)
+    if nBlocks < 2:
+        return np.repeat(np.nan, np.shape(estimate)).reshape(np.shape(estimate))
+    pseudo = nBlocks * estimate - (nBlocks - 1) * partial
+    return np.sqrt(pseudo.var(axis=0, ddof=1) / nBlocks)
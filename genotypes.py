@@ -0,0 +1,185 @@
+#! /usr/bin/env python
+'''
+Block reader for the calls-table format.
+
+Instead of splitting every line and building a Python list per site, the
+table is read in blocks of lines and returned as NumPy arrays: chromosome
+names, positions and a uint8 matrix (sites x samples) of one-letter genotype
+codes. The genotypes are decoded from the bytes of a block with lookup
+tables, without making a string per field: two-character genotypes (A/T,
+./.) are converted to the one-letter IUPAC codes, like calls.twoToOne()
+does. Counts of heterozygotes and missing genotypes are then array
+reductions over the block.
+
+#Example:
+
+import genotypes
+
+with open('input.tab') as datafile:
+    header_words = datafile.readline().split()
+    sampCol = calls.indexSamples(sampleNames, header_words)
+    for Chr, pos, gt in genotypes.readBlocks(datafile, sampCol,
+                                             len(header_words)):
+        numN = genotypes.countPerSite(gt, 'N')
+
+#contact:
+
+Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
+
+'''
+
+############################# modules #############################
+
+import itertools
+import numpy as np
+
+############################# constants #############################
+
+BLOCK_SIZE = 10000  # number of lines parsed at once
+
+N = ord('N')
+HETERO = 'RYMKSW'
+
+
+def _twoToOneTable():
+    ''' creates a lookup table of one-letter codes for pairs of alleles'''
+    table = np.empty((256, 256), dtype=np.uint8)
+    table.fill(N)
+    iupac = {'AG': 'R', 'CT': 'Y', 'AC': 'M',
+             'GT': 'K', 'CG': 'S', 'AT': 'W'}
+    for a in 'ACGT-':
+        table[ord(a), ord(a)] = ord(a)
+    for pair, code in iupac.items():
+        table[ord(pair[0]), ord(pair[1])] = ord(code)
+        table[ord(pair[1]), ord(pair[0])] = ord(code)
+    return table
+
+TWO_TO_ONE = _twoToOneTable()
+TWO_TO_ONE_FLAT = TWO_TO_ONE.ravel()  # indexed by 256*first + second allele
+
+# field separators of str.split()
+IS_SPACE = np.zeros(256, dtype=bool)
+IS_SPACE[[ord(c) for c in ' \t\n\r\x0b\x0c']] = True
+SLASH = ord('/')
+
+IS_HETERO = np.zeros(256, dtype=bool)
+IS_HETERO[[ord(c) for c in HETERO]] = True
+
+############################# functions #############################
+
+def _readLines(datafile, blockSize):
+    ''' returns the next blockSize lines of a file without blank lines,
+    an empty list at the end of the file'''
+    while True:
+        lines = list(itertools.islice(datafile, blockSize))
+        if not lines:
+            return lines
+        lines = [line for line in lines if not line.isspace()]
+        if lines:
+            return lines
+
+
+def readTokenBlocks(datafile, nColumns, blockSize=BLOCK_SIZE):
+    ''' yields 2D arrays (sites x columns) of the table fields,
+    blank lines are skipped'''
+    while True:
+        lines = _readLines(datafile, blockSize)
+        if not lines:
+            break
+        words = ''.join(lines).split()
+        if len(words) != len(lines) * nColumns:
+            raise IOError('Rows with a number of columns different from'
+                          ' the header (%s) are found' % nColumns)
+        yield np.array(words).reshape(len(lines), nColumns)
+
+
+def _decode(first, second, third):
+    ''' one-letter codes of calls from their first three bytes'''
+    pairs = first * np.uint16(256)
+    pairs += third
+    return np.where(second == SLASH, TWO_TO_ONE_FLAT.take(pairs), first)
+
+
+def genotypeCodes(tokens):
+    ''' converts an array of one- or two-character calls to
+    uint8 one-letter codes'''
+    tokens = np.ascontiguousarray(tokens)
+    width = tokens.dtype.itemsize
+    if width < 3:
+        return tokens.view(np.uint8).reshape(tokens.shape + (width,))[..., 0]
+    raw = tokens.view(np.uint8).reshape(tokens.shape + (width,))
+    return _decode(raw[..., 0], raw[..., 1], raw[..., 2])
+
+
+def decodeBlock(text, nLines, sampCol, nColumns):
+    ''' splits the text of nLines lines into fields and returns chromosome,
+    position and genotype arrays. The genotypes are decoded from the bytes
+    of their fields, only the chromosome and position fields become strings'''
+    # two spaces let the first three bytes of the last field be read
+    raw = np.frombuffer(text + '  ', dtype=np.uint8)
+    space = IS_SPACE[raw]
+    starts = np.flatnonzero(~space[1:] & space[:-1]) + 1
+    if not space[0]:
+        starts = np.r_[0, starts]
+    if len(starts) != nLines * nColumns:
+        raise IOError('Rows with a number of columns different from'
+                      ' the header (%s) are found' % nColumns)
+    starts = starts.reshape(nLines, nColumns)
+    ends = np.flatnonzero(space[1:] & ~space[:-1]).reshape(nLines, nColumns) + 1
+    Chrs = np.array([text[s:e] for s, e in zip(starts[:, 0].tolist(),
+                                               ends[:, 0].tolist())])
+    positions = np.fromstring(' '.join([text[s:e] for s, e in zip(
+        starts[:, 1].tolist(), ends[:, 1].tolist())]), dtype=np.int64, sep=' ')
+    if len(positions) != nLines:
+        raise IOError('Positions that are not integers are found')
+    fields = starts[:, sampCol]
+    codes = _decode(raw[fields], raw[fields + 1], raw[fields + 2])
+    return Chrs, positions, codes
+
+
+def readBlocks(datafile, sampCol, nColumns, blockSize=BLOCK_SIZE):
+    ''' yields chromosome, position and genotype arrays for blocks of sites,
+    blank lines are skipped'''
+    while True:
+        lines = _readLines(datafile, blockSize)
+        if not lines:
+            break
+        yield decodeBlock(''.join(lines), len(lines), sampCol, nColumns)
+
+
+def countPerSite(genotypes, code):
+    ''' counts a genotype code at every site of a block'''
+    return (genotypes == ord(code)).sum(axis=1)
+
+
+def countHeteroPerSite(genotypes):
+    ''' counts heterozygous IUPAC codes at every site of a block'''
+    return IS_HETERO[genotypes].sum(axis=1)
+
+
+def isHetero(genotypes):
+    ''' heterozygous IUPAC codes of a block (sites x samples)'''
+    return IS_HETERO[genotypes]
+
+
+def isCalled(genotypes):
+    ''' genotypes of a block that are not missing (sites x samples)'''
+    return genotypes != N
+
+
+def countAlleles(genotypes, alleles):
+    ''' counts each of the given one-letter codes at every site of a block,
+    returns a matrix (sites x alleles)'''
+    counts = np.empty((genotypes.shape[0], len(alleles)), dtype=np.int64)
+    for i, allele in enumerate(alleles):
+        counts[:, i] = (genotypes == ord(allele)).sum(axis=1)
+    return counts
+
+
+def isFixedHeteroPerSite(genotypes):
+    ''' checks if all called samples at a site carry the same
+    heterozygous code'''
+    called = genotypes != N
+    first = genotypes[np.arange(len(genotypes)), called.argmax(axis=1)]
+    same = ((genotypes == first[:, None]) | ~called).all(axis=1)
+    return same & called.any(axis=1) & IS_HETERO[first]
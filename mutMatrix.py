@@ -43,6 +43,9 @@ A       T       G       C
 
 $ python mutMatrix.py -i datafile -o outputfile -s "sample1,sample2,sample3,sample4"
 
+Only the sites present in the ancestor file are used, both for the allele totals (the first table)
+and for the mutation counts. Sites absent from the ancestor file are skipped.
+
 
 contact Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
 
@@ -51,8 +54,12 @@ contact Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
 ############################# modules #############################
 
 #import collections
+import ancestor # indexed ancestral states
+import bgzf # compressed input and output
 import calls # my custom module
-import collections
+import genotypes # block reader of calls tables
+import numpy as np
+import tabindex # index of tables and region queries
 
 ############################# options #############################
 
@@ -62,130 +69,71 @@ parser.add_argument('-a', '--ancestral', help = 'name of the file with ancestral
 parser.add_argument('-o', '--output', help = 'name of the output file', type=str, required=True)
 parser.add_argument('-s', '--samples', help = 'column names of the samples for with to calculate Ns', type=str, required=False)
 parser.add_argument('-N', '--missing', help = 'number of allowed Ns', type=int, required=True)
+parser.add_argument('-r', '--region', help = 'region to process, chr:start-end (optional)', type=str, required=False)
 args = parser.parse_args()
 
 # check if samples names are given and if all sample names are present in a header
-sampleNames = calls.checkSampleNames(args.samples, args.input)
+sampleNames = tabindex.checkSampleNames(args.samples, args.input)
 
 ############################# program #############################
 
 counter = 0
 
-ref = open(args.ancestral, 'r')
-ref_header = ref.readline()
-words2 = ref.readline().split()
-ref_chr_pos = words2[0:2]
-ref_ch = int(ref_chr_pos[0].split('_')[1])
-ref_pos = int(ref_chr_pos[1])
-ancest = words2[2]
-
-totalA = 0
-totalT = 0
-totalG = 0
-totalC = 0
-
-totalAT = 0
-totalAG = 0
-totalAC = 0
-
-totalTA = 0
-totalTG = 0
-totalTC = 0
+# index or load the index of ancestral states
+ancestorStore = ancestor.loadAncestor(args.ancestral)
 
-totalCT = 0
-totalCG = 0
-totalCA = 0
+# genotype codes that are counted as alleles, nucleotides go first
+ALLELES = 'ATGC-RYMKSW'
+NUCLEOTIDES = 'ATGC'
 
-totalGT = 0
-totalGA = 0
-totalGC = 0
+totals = np.zeros(len(NUCLEOTIDES), dtype=np.int64)
+mutations = np.zeros((len(NUCLEOTIDES), len(NUCLEOTIDES)), dtype=np.int64)
 
 print('Opening the file...')
-with open(args.input) as datafile:
+with tabindex.openTable(args.input, args.region) as datafile:
   header_line = datafile.readline()
   header_words = header_line.split()
   
   # index samples
   sampCol = calls.indexSamples(sampleNames, header_words)
     
-  for line in datafile:
+  for chroms, positions, alleles in genotypes.readBlocks(datafile, sampCol, len(header_words)):
     # track progress
-    counter += 1
-    if counter % 1000000 == 0:
+    counter += len(positions)
+    if counter % 1000000 < len(positions):
       print str(counter), "lines processed"
 
-    words = line.split()
-    chr_pos = words[0:2]
-    ch = int(words[0].split('_')[1])
-    pos = int(words[1])
+    # count Ns
+    valueN = genotypes.countPerSite(alleles, 'N')
+    keep = valueN <= args.missing
+    alleles = alleles[keep]
 
-     # select samples
-    alleles = calls.selectSamples(sampCol, words)
+    # find overlap with the ancestor and skip unpolarized sites
+    ancestral = ancestor.lookupAncestor(ancestorStore, chroms[keep], positions[keep])
+    polarized = ancestral != genotypes.N
 
-    # count Ns
-    valueN = calls.countPerPosition(alleles, 'N')
-
-    if valueN <= args.missing:
-      Allalleles = [i for i in alleles if i != 'N']
-    else:
-      continue
-
-    # find overlap with the ancestor
-    while ch > ref_ch or (ch == ref_ch and pos > ref_pos):
-      words2 = ref.readline().split()
-      if words2 == []:
-        ancest = 'N'
-        break
-      else:
-        ref_chr_pos = words2[0:2]
-        ref_ch = int(ref_chr_pos[0].split('_')[1])
-        ref_pos = int(ref_chr_pos[1])
-        ancest = words2[2]
-    
-    # skip unpolarized sites
-    if ancest == 'N':
-         continue
- 
     # count alleles
-    numAl = collections.Counter(Allalleles)
-    numAlM = numAl.most_common()
-    totalA += int(numAl['A'])
-    totalT += int(numAl['T'])
-    totalG += int(numAl['G'])
-    totalC += int(numAl['C'])
-    
-    n = len(Allalleles)
-     
-    if len(numAlM) > 2:  # skip non-biallelic
-      continue
-    elif chr_pos == ref_chr_pos:
-      valueAnces = int(numAl[ancest])
-      valueDer = int(n-valueAnces)
-      AlelleDer = list(set(list(numAl))-set(ancest))
-      if ancest == 'A' and AlelleDer == ['T']:
-        totalAT += valueDer
-      elif ancest == 'A' and AlelleDer == ['G']:
-        totalAG += valueDer
-      elif ancest == 'A' and AlelleDer == ['C']:
-        totalAC += valueDer
-      elif ancest == 'T' and AlelleDer == ['A']:
-        totalTA += valueDer
-      elif ancest == 'T' and AlelleDer == ['G']:
-        totalTG += valueDer
-      elif ancest == 'T' and AlelleDer == ['C']:
-        totalTC += valueDer          
-      elif ancest == 'G' and AlelleDer == ['A']:
-        totalGA += valueDer
-      elif ancest == 'G' and AlelleDer == ['T']:
-        totalGT += valueDer
-      elif ancest == 'G' and AlelleDer == ['C']:
-        totalGC += valueDer
-      elif ancest == 'C' and AlelleDer == ['A']:
-        totalCA += valueDer
-      elif ancest == 'C' and AlelleDer == ['T']:
-        totalCT += valueDer
-      elif ancest == 'C' and AlelleDer == ['G']:
-        totalCG += valueDer
+    numAl = genotypes.countAlleles(alleles[polarized], ALLELES)
+    totals += numAl[:, :len(NUCLEOTIDES)].sum(axis=0)
+
+    # skip non-biallelic
+    biallelic = (numAl > 0).sum(axis=1) <= 2
+    n = numAl.sum(axis=1)
+    ancestralP = ancestral[polarized]
+    for a, ancAllele in enumerate(NUCLEOTIDES):
+      isAnc = biallelic & (ancestralP == ord(ancAllele))
+      for d in range(len(NUCLEOTIDES)):
+        if d != a:
+          # the only non-ancestral allele is the derived one
+          isDer = isAnc & (numAl[:, d] > 0) & (numAl[:, a] + numAl[:, d] == n)
+          mutations[a, d] += numAl[isDer, d].sum()
+
+totalA, totalT, totalG, totalC = totals.tolist()
+
+totalAT, totalAG, totalAC = mutations[0, [1, 2, 3]].tolist()
+totalTA, totalTG, totalTC = mutations[1, [0, 2, 3]].tolist()
+totalGT, totalGA, totalGC = mutations[2, [1, 0, 3]].tolist()
+totalCT, totalCG, totalCA = mutations[3, [1, 2, 0]].tolist()
 
 sA = float(totalAT)/float(totalA) + float(totalAG)/float(totalA) + float(totalAC)/float(totalA)
 sT = float(totalTA)/float(totalT) + float(totalTG)/float(totalT) + float(totalTC)/float(totalT)
@@ -210,13 +158,13 @@ pCG = float(totalCG) / (float(totalC) * M)
 pCT = float(totalCT) / (float(totalC) * M)
 pCC = 1 - (pCT + pCG + pCA)
 
-output = open(args.output, 'w')
+output = bgzf.openFile(args.output, 'w')
 output.write("%.2f\t%.2f\t%.2f\t%.2f\n" % (pAA, pAT, pAG, pAC))
 output.write("%.2f\t%.2f\t%.2f\t%.2f\n" % (pTA, pTT, pTG, pTC))
 output.write("%.2f\t%.2f\t%.2f\t%.2f\n" % (pGA, pTT, pGG, pGC))
 output.write("%.2f\t%.2f\t%.2f\t%.2f\n" % (pCA, pCT, pCG, pCC))
 
-output2 = open("Total-Allele-Counts" + args.output, 'w')
+output2 = bgzf.openFile("Total-Allele-Counts" + args.output, 'w')
 output2.write("A\tT\tG\tC\n")
 output2.write("%s\t%s\t%s\t%s\n" % (totalA, totalT, totalG, totalC))
 
@@ -230,5 +178,5 @@ print("%.2f\t%.2f\t%.2f\t%.2f" % (pCA, pCT, pCG, pCC))
 
 datafile.close()
 output.close()
-ref.close()
+output2.close()
 print('Done!')
@@ -0,0 +1,474 @@
+#! /usr/bin/env python
+'''
+Index of tab-delimited tables, region queries and parallel processing of
+chromosomes.
+
+The index is a sidecar file (input.tab.idx) with the byte offset of the
+first line of every chromosome and sparse checkpoints: the offset of the
+first line at or after every N bp (10 kb by default). It is created once
+and used by all scripts to seek straight to a region given as
+-r chr:start-end, -r chr:start or -r chr. It can also be created in advance:
+
+$ python tabindex.py -i input.tab -s 10000
+
+The window scripts reset their state at every chromosome, so chromosomes
+can be processed independently. chromosomeRanges() returns the byte
+offsets where every chromosome starts and ends, from the index if it
+exists or by bisection over the file otherwise. runSharded() processes
+chromosomes in a pool of processes and returns the results in the original
+chromosome order. Scripts that process every line independently can also
+split large chromosomes in pieces of about a given number of bytes
+(shardRanges()).
+
+The lines of every chromosome are expected to be contiguous and sorted by
+position in the file.
+
+Tables can be plain text, gzip or bgzip compressed (see bgzf.py). In
+bgzipped tables the index stores virtual offsets, so region queries and
+parallel processing work as on plain text. Plain gzip files cannot be
+seeked: region queries scan the file and parallel processing is not
+possible, compress them with bgzip instead.
+
+#Example:
+
+import tabindex
+
+with tabindex.openTable(args.input, args.region) as datafile:
+    header_line = datafile.readline()
+    for line in datafile:
+        ...
+
+def processShard(fileName, start, end, resumed):
+    output = StringIO.StringIO()
+    for line in tabindex.readRange(fileName, start, end):
+        ...
+    return output.getvalue()
+
+for text in tabindex.runSharded(args.input, processShard, args.threads):
+    outputFile.write(text)
+
+#contact:
+
+Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
+
+'''
+
+############################# modules #############################
+
+import argparse
+import bgzf # transparent reading of compressed files
+import bisect
+import multiprocessing
+import os
+import re
+import sys
+
+############################# constants #############################
+
+INDEX_STEP = 10000  # distance between position checkpoints of the index
+
+############################# functions #############################
+
+def _lineAfter(datafile, offset):
+    ''' returns the offset and chromosome of the first line
+    that starts at or after offset, chromosome is None at the end of file'''
+    datafile.seek(offset - 1)
+    datafile.readline()
+    start = datafile.tell()
+    words = datafile.readline().split(None, 1)
+    if not words:
+        return start, None
+    return start, words[0]
+
+
+def indexName(fileName):
+    ''' returns the name of the index file of a table'''
+    return fileName + '.idx'
+
+
+def _linesWithOffsets(fileName):
+    ''' yields the lines of a plain or bgzipped table with the offsets
+    (virtual offsets in bgzipped files) where they start'''
+    compression = bgzf.fileFormat(fileName)
+    if compression == 'gzip':
+        raise IOError('%s is gzip compressed and cannot be indexed,'
+                      ' compress it with bgzip instead' % fileName)
+    if compression == 'bgzf':
+        with bgzf.BgzfReader(fileName) as datafile:
+            while True:
+                offset = datafile.tell()
+                line = datafile.readline()
+                yield offset, line
+                if not line:
+                    break
+    else:
+        with open(fileName, 'rb') as datafile:
+            offset = 0
+            for line in datafile:
+                yield offset, line
+                offset += len(line)
+            yield offset, ''
+
+
+def buildIndex(fileName, step=INDEX_STEP):
+    ''' scans a table and returns its index: a list of chromosomes and
+    for every chromosome a list of (position, offset) checkpoints'''
+    chromosomes = []
+    checkpoints = {}
+    lines = _linesWithOffsets(fileName)
+    offset, line = next(lines)
+    # skip the header and meta-information lines
+    while line.startswith('##'):
+        offset, line = next(lines)
+    ChrPrevious = None
+    nextPos = 0
+    for offset, line in lines:
+        words = line.split(None, 2)
+        if words:
+            Chr = words[0]
+            pos = int(float(words[1]))
+            if Chr != ChrPrevious:
+                if Chr in checkpoints:
+                    raise IOError('Chromosome "%s" is not contiguous in %s'
+                                  % (Chr, fileName))
+                chromosomes.append(Chr)
+                checkpoints[Chr] = [(pos, offset)]
+                nextPos = (pos // step + 1) * step
+                ChrPrevious = Chr
+            elif pos >= nextPos:
+                checkpoints[Chr].append((pos, offset))
+                nextPos = (pos // step + 1) * step
+    # the last offset is the end of the file
+    return {'chromosomes': chromosomes, 'checkpoints': checkpoints,
+            'size': offset, 'step': step}
+
+
+def saveIndex(index, indexFile):
+    ''' writes an index to a tab-delimited file, under a temporary name that
+    is renamed at the end, so that concurrent runs never read a partial index'''
+    tmpFile = '%s.%s.tmp' % (indexFile, os.getpid())
+    output = open(tmpFile, 'w')
+    output.write("#size\t%s\n#step\t%s\n" % (index['size'], index['step']))
+    output.write("#CHROM\tPOS\tOFFSET\n")
+    for Chr in index['chromosomes']:
+        for pos, offset in index['checkpoints'][Chr]:
+            output.write("%s\t%s\t%s\n" % (Chr, pos, offset))
+    output.close()
+    os.rename(tmpFile, indexFile)
+
+
+def readIndex(indexFile):
+    ''' reads an index saved with saveIndex()'''
+    index = {'chromosomes': [], 'checkpoints': {}}
+    with open(indexFile) as idx:
+        for line in idx:
+            words = line.split()
+            if words[0] == '#size':
+                index['size'] = int(words[1])
+            elif words[0] == '#step':
+                index['step'] = int(words[1])
+            elif not words[0].startswith('#'):
+                Chr = words[0]
+                if Chr not in index['checkpoints']:
+                    index['chromosomes'].append(Chr)
+                    index['checkpoints'][Chr] = []
+                index['checkpoints'][Chr].append((int(words[1]),
+                                                  int(words[2])))
+    return index
+
+
+def hasIndex(fileName):
+    ''' checks if a table has an index that is not older than the table'''
+    indexFile = indexName(fileName)
+    return (os.path.exists(indexFile) and
+            os.path.getmtime(indexFile) >= os.path.getmtime(fileName))
+
+
+def loadIndex(fileName, step=INDEX_STEP):
+    ''' loads the index of a table, builds it if it is absent or
+    older than the table'''
+    if hasIndex(fileName):
+        return readIndex(indexName(fileName))
+    sys.stderr.write('Indexing %s ...\n' % fileName)
+    index = buildIndex(fileName, step)
+    try:
+        saveIndex(index, indexName(fileName))
+    except (IOError, OSError):
+        sys.stderr.write('WARNING: the index could not be saved to %s\n'
+                         % indexName(fileName))
+    return index
+
+
+def indexRanges(index):
+    ''' returns a list of (chromosome, start, end) byte offsets
+    of the chromosomes in an index'''
+    starts = [index['checkpoints'][Chr][0][1] for Chr in index['chromosomes']]
+    ends = starts[1:] + [index['size']]
+    return zip(index['chromosomes'], starts, ends)
+
+
+def parseRegion(region):
+    ''' splits a region chr:start-end into its chromosome, start and end,
+    start and end are None if they are not given'''
+    match = re.match(r'^(.+?)(?::([\d,]+)?(?:-([\d,]+))?)?$', region)
+    if not match:
+        raise IOError('Region "%s" is not in the format chr:start-end' % region)
+    Chr, start, end = match.groups()
+    if start is not None:
+        start = int(start.replace(',', ''))
+    if end is not None:
+        end = int(end.replace(',', ''))
+    return Chr, start, end
+
+
+def regionOffsets(index, region):
+    ''' returns the byte offsets of the lines that can overlap a region'''
+    Chr, start, end = parseRegion(region)
+    if Chr not in index['checkpoints']:
+        raise IOError('Chromosome "%s" is not found in the index' % Chr)
+    checkpoints = index['checkpoints'][Chr]
+    ranges = dict((c, (s, e)) for c, s, e in indexRanges(index))
+    chrStart, chrEnd = ranges[Chr]
+    positions = [pos for pos, offset in checkpoints]
+    offsetStart = chrStart
+    offsetEnd = chrEnd
+    if start is not None:
+        i = bisect.bisect_right(positions, start) - 1
+        if i >= 0:
+            offsetStart = checkpoints[i][1]
+    if end is not None:
+        i = bisect.bisect_right(positions, end)
+        if i < len(checkpoints):
+            offsetEnd = checkpoints[i][1]
+    return offsetStart, offsetEnd
+
+
+def inRegion(lines, region):
+    ''' yields the lines with positions inside a region'''
+    Chr, start, end = parseRegion(region)
+    for line in lines:
+        pos = int(float(line.split(None, 2)[1]))
+        if end is not None and pos > end:
+            break
+        if start is None or pos >= start:
+            yield line
+
+
+def scanRegion(lines, region):
+    ''' yields the lines of a region from all lines of a table,
+    for files that cannot be seeked'''
+    Chr, start, end = parseRegion(region)
+    found = False
+    for line in lines:
+        words = line.split(None, 2)
+        if not words or words[0] != Chr:
+            if found:
+                break
+            continue
+        found = True
+        pos = int(float(words[1]))
+        if end is not None and pos > end:
+            break
+        if start is None or pos >= start:
+            yield line
+
+
+class TableReader(object):
+    ''' reads a table, the lines before the data (header) are read with
+    readline() and the iteration yields the data lines of a region'''
+
+    def __init__(self, fileName, region=None):
+        self.fileName = fileName
+        self.region = region
+        self.compression = bgzf.fileFormat(fileName)
+        self.datafile = bgzf.openFile(fileName)
+        self.lines = None
+
+    def readline(self):
+        return self.datafile.readline()
+
+    def __iter__(self):
+        if self.lines is None:
+            if self.region and self.compression == 'gzip':
+                self.lines = scanRegion(self.datafile, self.region)
+            elif self.region:
+                start, end = regionOffsets(loadIndex(self.fileName),
+                                           self.region)
+                self.lines = inRegion(readRange(self.fileName, start, end),
+                                      self.region)
+            else:
+                self.lines = iter(self.datafile)
+        return self.lines
+
+    def close(self):
+        self.datafile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def openTable(fileName, region=None):
+    ''' opens a table to read the lines of a region chr:start-end,
+    all lines if region is None'''
+    return TableReader(fileName, region)
+
+
+def checkSampleNames(sampleNames, fileName):
+    ''' like calls.checkSampleNames(), checks that all sample names are
+    present in the header of a table, which can be compressed. Returns a list
+    of the names or all sample columns if sampleNames is None'''
+    with bgzf.openFile(fileName) as datafile:
+        header_words = datafile.readline().split()
+    if sampleNames is None:
+        return header_words[2:]
+    sampleNames = sampleNames.split(',')
+    for sample in sampleNames:
+        if sample not in header_words:
+            raise IOError('Sample name "%s" is not found in the header' % sample)
+    return sampleNames
+
+
+def chromosomeRanges(fileName):
+    ''' returns a list of (chromosome, start, end) byte offsets of the
+    chromosomes of a table, the header line is excluded'''
+    if hasIndex(fileName):
+        return indexRanges(readIndex(indexName(fileName)))
+    if bgzf.fileFormat(fileName) != 'text':
+        # compressed files are indexed by a linear scan
+        return indexRanges(loadIndex(fileName))
+    fileSize = os.path.getsize(fileName)
+    ranges = []
+    with open(fileName, 'rb') as datafile:
+        datafile.readline()
+        start, Chr = _lineAfter(datafile, datafile.tell())
+        while Chr is not None:
+            # gallop forward until a line of another chromosome is found
+            lo = start
+            hi = fileSize + 1
+            step = 1 << 16
+            while start + step <= fileSize:
+                if _lineAfter(datafile, start + step)[1] != Chr:
+                    hi = start + step
+                    break
+                lo = start + step
+                step *= 2
+            # bisect to the last line of the chromosome
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if _lineAfter(datafile, mid)[1] == Chr:
+                    lo = mid
+                else:
+                    hi = mid
+            end, nextChr = _lineAfter(datafile, hi)
+            if any(Chr == r[0] for r in ranges):
+                raise IOError('Chromosome "%s" is not contiguous in %s'
+                              % (Chr, fileName))
+            ranges.append((Chr, start, min(end, fileSize)))
+            start, Chr = end, nextChr
+    return ranges
+
+
+def readRange(fileName, start, end):
+    ''' yields the lines between two byte offsets of a file,
+    virtual offsets if it is bgzipped'''
+    if bgzf.fileFormat(fileName) == 'bgzf':
+        with bgzf.BgzfReader(fileName) as datafile:
+            datafile.seek(start)
+            while datafile.tell() < end:
+                line = datafile.readline()
+                if not line:
+                    break
+                yield line
+        return
+    with open(fileName, 'rb') as datafile:
+        datafile.seek(start)
+        offset = start
+        while offset < end:
+            line = datafile.readline()
+            if not line:
+                break
+            offset += len(line)
+            yield line
+
+
+def _splitRange(fileName, index, Chr, start, end, shardSize):
+    ''' returns the offsets where a chromosome is split in pieces of about
+    shardSize bytes, at line starts (at checkpoints of the index in
+    bgzipped files)'''
+    if index is not None:
+        # virtual offsets: the compressed offset is in the upper 48 bits
+        splits = []
+        for pos, offset in index['checkpoints'][Chr][1:]:
+            if (offset >> 16) - ((splits[-1] if splits else start) >> 16) >= shardSize:
+                splits.append(offset)
+        return splits
+    splits = []
+    with open(fileName, 'rb') as datafile:
+        offset = start + shardSize
+        while offset < end:
+            lineStart = _lineAfter(datafile, offset)[0]
+            if lineStart >= end:
+                break
+            splits.append(lineStart)
+            offset = lineStart + shardSize
+    return splits
+
+
+def shardRanges(fileName, shardSize=None):
+    ''' returns a list of (chromosome, start, end) offsets of the chromosomes
+    of a table, chromosomes larger than shardSize bytes are split in pieces
+    at line starts'''
+    ranges = chromosomeRanges(fileName)
+    if not shardSize:
+        return ranges
+    index = None
+    if bgzf.fileFormat(fileName) != 'text':
+        index = loadIndex(fileName)
+    shards = []
+    for Chr, start, end in ranges:
+        offsets = [start] + _splitRange(fileName, index, Chr, start, end, shardSize) + [end]
+        shards.extend((Chr, s, e) for s, e in zip(offsets[:-1], offsets[1:]))
+    return shards
+
+
+def _runShard(shard):
+    ''' calls a shard function in a worker process'''
+    processShard, fileName, start, end, resumed = shard
+    return processShard(fileName, start, end, resumed)
+
+
+def runSharded(fileName, processShard, threads, shardSize=None):
+    ''' yields the results of processShard(fileName, start, end, resumed)
+    for every chromosome of a file in the file order. resumed is False only
+    for the first chromosome, the others start after a chromosome change.
+    With shardSize the chromosomes larger than shardSize bytes are split in
+    pieces, this is only for scripts that process every line independently.
+    processShard must be a module-level function, the state it needs is
+    inherited by the worker processes when they are created.'''
+    shards = [(processShard, fileName, start, end, i > 0)
+              for i, (Chr, start, end) in
+              enumerate(shardRanges(fileName, shardSize))]
+    pool = multiprocessing.Pool(threads)
+    try:
+        for result in pool.imap(_runShard, shards):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+############################# program #############################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Indexes a table.')
+    parser.add_argument('-i', '--input', help='name of the input file',
+                        type=str, required=True)
+    parser.add_argument('-s', '--step', help='distance between position checkpoints',
+                        type=int, required=False, default=INDEX_STEP)
+    args = parser.parse_args()
+    saveIndex(buildIndex(args.input, args.step), indexName(args.input))
+    print('Done!')
@@ -0,0 +1,544 @@
+#! /usr/bin/env python
+'''
+Sliding window engine shared by the window scripts.
+
+slideWindows() groups blocks of sites (chromosome, position and data arrays)
+into non-overlapping windows of a given size in bp and yields every window
+with its chromosome, start, end and data. The window bounds are found for a
+whole block at once and the data of a window is collected by a window object
+(WindowValues by default, which keeps the rows of the window). The bounds
+follow the window scripts: windows are reported either between the ends of
+the previous and the current window or between the first and the last site
+of the window (siteBounds=True).
+
+slideSteps() yields overlapping windows that start every step bp and
+slideSites() windows of a fixed number of informative sites. Both keep only
+the sums of the open windows (WindowSums).
+
+Several statistics can be calculated for every window in one pass over a
+table. As a script, it writes the statistics of all value columns:
+
+$ python windows.py -i input.tab -o output.tab -w 50000 -S mean,median,q0.9,prop:2
+
+Statistics:
+n           number of values that are not NA
+mean        mean
+median      median
+qX          quantile X (0-1), e.g. q0.25
+sum         sum
+min, max    minimum and maximum
+var         variance (N-1 in the denominator)
+count:X     number of values equal to or larger than X
+prop:X      proportion of values equal to or larger than X
+abscount:X  number of values with absolute value equal to or larger than X
+absprop:X   proportion of values with absolute value equal to or larger than X
+
+The output columns are named column_statistic. NA, Inf and -Inf values are
+skipped.
+
+Chromosomes can be processed in parallel with -T (number of processes). The
+lines of every chromosome must be contiguous in the input file.
+
+#Example:
+
+import windows
+
+blocks = windows.readValueBlocks(datafile, len(header_words))
+for Chr, start, end, values in windows.slideWindows(blocks, windSize):
+    means = windows.windowMean(values)
+
+#contact:
+
+Dmytro Kryvokhyzha dmytro.kryvokhyzha@evobio.eu
+
+'''
+
+############################# modules #############################
+
+import bgzf # compressed input and output
+import calls # my custom module
+import genotypes # block reader of tables
+import numpy as np
+import re
+import StringIO
+import tabindex # index of tables, region queries and parallel processing
+import warnings
+
+############################# functions #############################
+
+def readValueBlocks(lines, nColumns, missing=('NA', 'Inf', '-Inf'),
+                    blockSize=genotypes.BLOCK_SIZE):
+    ''' yields chromosome, position and value arrays for blocks of lines of a
+    table with values in all columns after the position, missing values
+    are NaN'''
+    for tokens in genotypes.readTokenBlocks(lines, nColumns, blockSize):
+        values = tokens[:, 2:]
+        values = np.where(np.in1d(values, missing).reshape(values.shape),
+                          'nan', values).astype(np.float64)
+        yield (tokens[:, 0], tokens[:, 1].astype(np.float64).astype(np.int64),
+               values)
+
+
+class WindowValues(object):
+    ''' collects the data rows of a window'''
+
+    def __init__(self):
+        self.parts = []
+
+    def add(self, data):
+        self.parts.append(data)
+
+    def values(self):
+        return np.concatenate(self.parts)
+
+
+class WindowSlider(object):
+    ''' assigns blocks of sites to windows of windSize bp and collects
+    finished windows. resumed is True if the sites start after a chromosome
+    change'''
+
+    def __init__(self, windSize, newWindow=WindowValues, resumed=False,
+                 siteBounds=False):
+        self.windSize = windSize
+        self.newWindow = newWindow
+        self.siteBounds = siteBounds
+        self.newFile = not resumed
+        self.Chr = None
+        self.window = None # the open window
+        self.windEnd = windSize
+        self.previousEnd = 0 # end of the previous window of a chromosome
+        self.posFirst = None
+        self.posLast = None
+        self.finished = []
+
+    def _close(self):
+        if self.siteBounds:
+            start, end = self.posFirst, self.posLast
+        else:
+            start, end = self.previousEnd, self.windEnd
+        self.finished.append((self.Chr, int(start), int(end), self.window))
+        self.previousEnd = self.windEnd
+        self.window = None
+
+    def add(self, chroms, positions, data):
+        w = self.windSize
+        bounds = np.flatnonzero(chroms[1:] != chroms[:-1]) + 1
+        for s, e in zip(np.r_[0, bounds], np.r_[bounds, len(chroms)]):
+            Chr = chroms[s]
+            pos = positions[s:e]
+            # window ends are multiples of the window size
+            ends = -(-pos // w) * w
+            if Chr == self.Chr:
+                ends = np.maximum(ends, self.windEnd)
+            elif self.newFile:
+                ends = np.maximum(ends, w)
+                if ends[0] > w:
+                    # the first site is beyond the first window,
+                    # an empty window is reported
+                    self.Chr = Chr
+                    self.window = self.newWindow()
+                    self.posFirst = self.posLast = pos[0]
+                    self._close()
+            else:
+                # the first window of a chromosome starts at its first site
+                if self.window is not None:
+                    self._close()
+                ends[0] = w
+                self.previousEnd = 0
+            self.newFile = False
+            ends = np.maximum.accumulate(ends)
+            changes = np.flatnonzero(ends[1:] != ends[:-1]) + 1
+            for a, b in zip(np.r_[0, changes], np.r_[changes, len(ends)]):
+                if (self.window is None or Chr != self.Chr or
+                        ends[a] != self.windEnd):
+                    if self.window is not None:
+                        self._close()
+                    self.Chr = Chr
+                    self.window = self.newWindow()
+                    self.windEnd = ends[a]
+                    self.posFirst = pos[a]
+                self.window.add(data[s+a:s+b])
+                self.posLast = pos[b-1]
+
+    def finish(self):
+        if self.window is not None:
+            self._close()
+
+
+def slideWindows(blocks, windSize, newWindow=WindowValues, resumed=False,
+                 siteBounds=False):
+    ''' yields chromosome, start, end and data of the windows of windSize bp
+    of blocks of sites, the data are collected by window objects created by
+    newWindow(). Windows with WindowValues yield the matrix of their rows.
+    start and end are the ends of the previous and the current window or,
+    with siteBounds, the first and the last sites of the window'''
+    slider = WindowSlider(windSize, newWindow, resumed, siteBounds)
+    counter = 0
+    for chroms, positions, data in blocks:
+        slider.add(chroms, positions, data)
+        for window in slider.finished:
+            yield _windowData(window)
+        slider.finished = []
+        # track progress
+        counter += len(positions)
+        if counter // 1000000 != (counter - len(positions)) // 1000000:
+            print str(counter), "lines processed"
+    slider.finish()
+    for window in slider.finished:
+        yield _windowData(window)
+
+
+def _windowData(window):
+    Chr, start, end, data = window
+    if isinstance(data, WindowValues):
+        if data.parts:
+            data = data.values()
+        else:
+            data = None
+    return Chr, start, end, data
+
+
+class WindowSums(object):
+    ''' sums of the data rows of a window and numbers of rows that are not
+    NaN, rows can be added and removed'''
+
+    def __init__(self, nColumns):
+        self.sums = np.zeros(nColumns, dtype=np.longdouble)
+        self.counts = np.zeros(nColumns, dtype=np.int64)
+
+    def add(self, data, sign=1):
+        valid = ~np.isnan(data)
+        self.sums += sign * np.where(valid, data, 0).sum(axis=0)
+        self.counts += sign * valid.sum(axis=0)
+
+    def remove(self, data):
+        self.add(data, -1)
+
+    def mean(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.counts > 0,
+                            self.sums.astype(np.float64) / self.counts, np.nan)
+
+
+class StepSlider(object):
+    ''' moves windows (start, start + windSize] with start at multiples of
+    step along the sites of a chromosome. The sites entering a window are
+    added to a WindowSums and the sites leaving it are removed, only the
+    sites of the current window are kept'''
+
+    def __init__(self, Chr, windSize, step, nColumns):
+        self.Chr = Chr
+        self.windSize = windSize
+        self.step = step
+        self.window = WindowSums(nColumns)
+        self.positions = np.zeros(0, dtype=np.int64)
+        self.data = None
+        self.lo = 0 # sites lo to hi of the buffer are in the window
+        self.hi = 0
+        self.start = None
+
+    def add(self, positions, data):
+        # drop the sites that are left of the current window
+        self.positions = np.concatenate([self.positions[self.lo:], positions])
+        if self.data is None:
+            self.data = data
+        else:
+            self.data = np.concatenate([self.data[self.lo:], data])
+        self.hi -= self.lo
+        self.lo = 0
+        if self.start is None:
+            # the first window with the first site
+            first = -(-(positions[0] - self.windSize) // self.step)
+            self.start = max(first, 0) * self.step
+
+    def windows(self, final=False):
+        ''' yields start, end and the sums of the windows that are complete:
+        a site after their end is read, or all windows if final'''
+        P = self.positions
+        while self.start is not None:
+            start = self.start
+            end = start + self.windSize
+            if not final and end >= P[-1]:
+                break
+            lo = np.searchsorted(P, start, side='right')
+            hi = np.searchsorted(P, end, side='right')
+            if lo >= self.hi:
+                # no sites are shared with the previous window
+                self.window = WindowSums(len(self.window.sums))
+                self.window.add(self.data[lo:hi])
+            else:
+                self.window.remove(self.data[self.lo:lo])
+                self.window.add(self.data[self.hi:hi])
+            self.lo, self.hi = lo, hi
+            if hi > lo:
+                yield start, end, P[lo], P[hi-1], self.window
+            # skip the windows without sites
+            nextSite = np.searchsorted(P, start + self.step, side='right')
+            if nextSite < len(P):
+                nextStart = -(-(P[nextSite] - self.windSize) // self.step) * self.step
+                self.start = max(nextStart, start + self.step)
+            elif final:
+                self.start = None
+            else:
+                self.start = start + self.step
+
+
+def slideSteps(blocks, windSize, step, siteBounds=False):
+    ''' yields chromosome, start, end and WindowSums of the overlapping
+    windows (start, start + windSize] with start at multiples of step that
+    contain sites. start and end are the first and the last sites of the
+    window with siteBounds'''
+    slider = None
+    counter = 0
+    for chroms, positions, data in blocks:
+        bounds = np.flatnonzero(chroms[1:] != chroms[:-1]) + 1
+        for s, e in zip(np.r_[0, bounds], np.r_[bounds, len(chroms)]):
+            if slider is None or chroms[s] != slider.Chr:
+                if slider is not None:
+                    for window in slider.windows(final=True):
+                        yield _stepData(slider.Chr, window, siteBounds)
+                slider = StepSlider(chroms[s], windSize, step, data.shape[1])
+            slider.add(positions[s:e], data[s:e])
+            for window in slider.windows():
+                yield _stepData(slider.Chr, window, siteBounds)
+        # track progress
+        counter += len(positions)
+        if counter // 1000000 != (counter - len(positions)) // 1000000:
+            print str(counter), "lines processed"
+    if slider is not None:
+        for window in slider.windows(final=True):
+            yield _stepData(slider.Chr, window, siteBounds)
+
+
+def _stepData(Chr, window, siteBounds):
+    start, end, posFirst, posLast, sums = window
+    if siteBounds:
+        return Chr, int(posFirst), int(posLast), sums
+    return Chr, int(start), int(end), sums
+
+
+def anyValue(data):
+    ''' sites with at least one value that is not NaN'''
+    return ~np.isnan(data).all(axis=1)
+
+
+def slideSites(blocks, nSites, informative=anyValue):
+    ''' yields chromosome, first and last site and WindowSums of
+    non-overlapping windows of nSites informative sites, the last window of
+    a chromosome can have fewer sites. informative(data) returns the mask of
+    the informative sites of a block, the other sites are skipped. Only the
+    sums of the open window are kept'''
+    Chr = None
+    window = None
+    counter = 0
+    for chroms, positions, data in blocks:
+        keep = informative(data)
+        chromsKept = chroms[keep]
+        positions = positions[keep]
+        data = data[keep]
+        bounds = np.flatnonzero(chromsKept[1:] != chromsKept[:-1]) + 1
+        for s, e in zip(np.r_[0, bounds], np.r_[bounds, len(chromsKept)]):
+            if s == e:
+                continue
+            if chromsKept[s] != Chr:
+                if window is not None:
+                    yield Chr, int(posFirst), int(posLast), window
+                Chr = chromsKept[s]
+                window = None
+            while s < e:
+                if window is None:
+                    window = WindowSums(data.shape[1])
+                    nWindow = 0
+                    posFirst = positions[s]
+                take = min(nSites - nWindow, e - s)
+                window.add(data[s:s+take])
+                nWindow += take
+                posLast = positions[s+take-1]
+                s += take
+                if nWindow == nSites:
+                    yield Chr, int(posFirst), int(posLast), window
+                    window = None
+        # track progress
+        counter += len(chroms)
+        if counter // 1000000 != (counter - len(chroms)) // 1000000:
+            print str(counter), "lines processed"
+    if window is not None:
+        yield Chr, int(posFirst), int(posLast), window
+
+
+def formatValues(values):
+    ''' creates a print string from an array of values, NaN as NA'''
+    return '\t'.join('NA' if v != v else str(v) for v in values.tolist())
+
+
+############################# statistics #############################
+
+# statistics of a window matrix (sites x columns) with NaN for missing
+# values, every function returns one value per column, NaN if a column
+# has no values
+
+def windowCount(values):
+    ''' number of values that are not missing'''
+    return (~np.isnan(values)).sum(axis=0)
+
+def windowSum(values):
+    ''' sums, the rows are added in order like sum() does'''
+    if len(values) == 0:
+        return np.zeros(values.shape[1])
+    # adding 0.0 turns -0.0 to 0.0, like sum() that starts from 0
+    return np.cumsum(np.nan_to_num(values), axis=0)[-1] + 0.0
+
+def windowMean(values):
+    n = windowCount(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n > 0, windowSum(values) / n, np.nan)
+
+def _nanReduce(function, values, *args):
+    ''' applies a NaN-aware NumPy function along the sites'''
+    if len(values) == 0:
+        return np.repeat(np.nan, values.shape[1])
+    with warnings.catch_warnings():
+        # columns with only missing values
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return function(values, *args, axis=0)
+
+def windowMedian(values):
+    return _nanReduce(np.nanmedian, values)
+
+def windowQuantile(values, q):
+    return _nanReduce(np.nanpercentile, values, q * 100)
+
+def windowMin(values):
+    return _nanReduce(np.nanmin, values)
+
+def windowMax(values):
+    return _nanReduce(np.nanmax, values)
+
+def windowVariance(values):
+    n = windowCount(values)
+    variance = _nanReduce(np.nanvar, values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n > 1, variance * n / (n - 1), np.nan)
+
+def countAbove(values, threshold, absolute=False):
+    ''' number of values equal to or larger than a threshold'''
+    if absolute:
+        values = np.abs(values)
+    with np.errstate(invalid='ignore'):
+        return (values >= threshold).sum(axis=0)
+
+def proportionAbove(values, threshold, absolute=False):
+    ''' proportion of values equal to or larger than a threshold'''
+    n = windowCount(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n > 0, countAbove(values, threshold, absolute) /
+                        n.astype(np.float64), np.nan)
+
+STATISTICS = {
+    'n': windowCount,
+    'mean': windowMean,
+    'median': windowMedian,
+    'sum': windowSum,
+    'min': windowMin,
+    'max': windowMax,
+    'var': windowVariance}
+
+def parseStatistics(names):
+    ''' converts a comma separated list of statistics (see above) to a list
+    of (name, function) where function calculates the statistic of a window'''
+    statistics = []
+    for name in names.split(','):
+        quantile = re.match(r'^q([\d.]+)$', name)
+        threshold = re.match(r'^(abs)?(count|prop):(-?[\d.]+)$', name)
+        if name in STATISTICS:
+            function = STATISTICS[name]
+        elif quantile and 0 <= float(quantile.group(1)) <= 1:
+            function = (lambda v, q=float(quantile.group(1)):
+                        windowQuantile(v, q))
+        elif threshold:
+            absolute = threshold.group(1) is not None
+            reducer = countAbove if threshold.group(2) == 'count' else proportionAbove
+            function = (lambda v, r=reducer, t=float(threshold.group(3)),
+                        a=absolute: r(v, t, a))
+        else:
+            raise IOError('Statistic "%s" is not known' % name)
+        statistics.append((name, function))
+    return statistics
+
+def windowStatistics(values, statistics, nColumns):
+    ''' calculates statistics of a window matrix, returns a print string
+    with the statistics of every column one after another'''
+    if values is None:
+        values = np.zeros((0, nColumns))
+    results = zip(*[function(values).tolist() for name, function in statistics])
+    return '\t'.join('NA' if v != v else str(v)
+                     for columnResults in results for v in columnResults)
+
+
+############################# program #############################
+
+def processLines(lines, outputFile, resumed=False):
+    ''' calculates statistics per window for the lines of the input file,
+    resumed is True if the lines start after a chromosome change'''
+    blocks = readValueBlocks(lines, len(header_words))
+    for Chr, start, end, values in slideWindows(blocks, args.window,
+                                                resumed=resumed):
+        calls.processWindow(Chr, start, end,
+                            windowStatistics(values, statistics,
+                                             len(valueNames)),
+                            outputFile)
+
+def processShard(fileName, start, end, resumed):
+    ''' calculates statistics per window for one chromosome of the input file'''
+    output = StringIO.StringIO()
+    processLines(tabindex.readRange(fileName, start, end), output, resumed)
+    return output.getvalue()
+
+
+if __name__ == '__main__':
+    parser = calls.CommandLineParser()
+    parser.add_argument(
+        '-i', '--input', help='name of the input file', type=str, required=True)
+    parser.add_argument(
+        '-o', '--output', help='name of the output file', type=str, required=True)
+    parser.add_argument(
+        '-w', '--window', help='sliding window size', type=int, required=True)
+    parser.add_argument(
+        '-S', '--statistics', help='comma separated list of statistics',
+        type=str, required=False, default='mean')
+    parser.add_argument(
+        '-T', '--threads', help='number of processes to process chromosomes in parallel',
+        type=int, required=False, default=1)
+    parser.add_argument(
+        '-r', '--region', help='region to process, chr:start-end (optional)',
+        type=str, required=False)
+    args = parser.parse_args()
+
+    statistics = parseStatistics(args.statistics)
+
+    print('Opening the file...')
+
+    with tabindex.openTable(args.input, args.region) as datafile:
+        header_line = datafile.readline()
+        header_words = header_line.split()
+        valueNames = header_words[2:]
+
+        # make output header
+        outputFile = bgzf.openFile(args.output, 'w')
+        statNames = ['%s_%s' % (v, name) for v in valueNames
+                     for name, function in statistics]
+        outputFile.write('%s\t%s\n' % ('\t'.join(header_words[:2]),
+                                       '\t'.join(statNames)))
+
+        print('Processing the data  ...')
+
+        if args.threads > 1 and not args.region:
+            for text in tabindex.runSharded(args.input, processShard,
+                                            args.threads):
+                outputFile.write(text)
+        else:
+            processLines(datafile, outputFile)
+
+    datafile.close()
+    outputFile.close()
+    print('Done!')